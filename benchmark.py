@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+模型前向的benchmark: 模型 x batch大小 x 线程数 x 输入分辨率 x 运行时选项
+输出每个配置的耗时分位数和吞吐，可以保存为json，并与之前的结果对比，检查性能回退
+运行时选项用+连接，如 fuse+channels_last+bf16:
+- eager: 原始模型
+- fuse: 折叠bn
+- channels_last: NHWC内存布局
+- bf16: autocast混合精度
+- torchscript: trace + freeze
+python benchmark.py -k large small -b 1 8 32 -t 1 4 -s 224 -o eager fuse+channels_last -j bench.json
+python benchmark.py -j bench_new.json --baseline bench.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import torch
+
+from model.fuse import fuse_model
+from model.model import MobileNetV3_large, MobileNetV3_small
+from model.precision import autocast
+
+NETS = {"large": MobileNetV3_large, "small": MobileNetV3_small}
+RUNTIME_OPTIONS = ("eager", "fuse", "channels_last", "bf16", "torchscript")
+
+
+def parse_option(option):
+    """
+    :param option: 如"fuse+channels_last"
+    :return: 选项集合
+    """
+    opts = set(option.split("+"))
+    unknown = opts - set(RUNTIME_OPTIONS)
+    assert not unknown, "未知的运行时选项: {}".format(unknown)
+    return opts
+
+
+def build_net(net_kind, option="fuse", img_size=224, num_classes=2):
+    """
+    按运行时选项创建模型，权重随机初始化，不影响耗时
+    :return: 模型和输入的内存布局
+    """
+    opts = parse_option(option)
+    net = NETS[net_kind](num_classes=num_classes).eval()
+    if "fuse" in opts or "torchscript" in opts:
+        net = fuse_model(net)
+    memory_format = torch.channels_last if "channels_last" in opts else torch.contiguous_format
+    net = net.to(memory_format=memory_format)
+    if "torchscript" in opts:
+        example = torch.randn(1, 3, img_size, img_size).contiguous(memory_format=memory_format)
+        with torch.no_grad(), autocast("bf16" if "bf16" in opts else "fp32", "cpu"):
+            net = torch.jit.freeze(torch.jit.trace(net, example, check_trace=False))
+    return net, memory_format
+
+
+def bench_one(net, batch_size, img_size=224, memory_format=torch.contiguous_format, precision="fp32",
+              n_warmup=5, n_repeat=20):
+    """
+    :return: 每次前向的耗时(秒)列表，不包括预热
+    """
+    x = torch.randn(batch_size, 3, img_size, img_size).contiguous(memory_format=memory_format)
+    elapsed = []
+    with torch.inference_mode(), autocast(precision, "cpu"):
+        for i in range(n_warmup + n_repeat):
+            s_time = time.perf_counter()
+            net(x)
+            if i >= n_warmup:
+                elapsed.append(time.perf_counter() - s_time)
+    return elapsed
+
+
+def summarize(elapsed, batch_size):
+    elapsed_ms = np.array(elapsed) * 1000
+    return {
+        "mean_ms": float(elapsed_ms.mean()),
+        "std_ms": float(elapsed_ms.std()),
+        "p50_ms": float(np.percentile(elapsed_ms, 50)),
+        "p90_ms": float(np.percentile(elapsed_ms, 90)),
+        "p99_ms": float(np.percentile(elapsed_ms, 99)),
+        "min_ms": float(elapsed_ms.min()),
+        "throughput": float(batch_size * 1000 / np.median(elapsed_ms)),  # 张/s，用中位数，不受偶发的慢请求影响
+    }
+
+
+def get_env_info():
+    cpu_name = platform.processor()
+    if os.path.isfile("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_name = line.split(":", 1)[1].strip()
+                    break
+    return {"torch": torch.__version__, "python": platform.python_version(), "cpu": cpu_name,
+            "cpu_count": os.cpu_count(), "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def get_key(res):
+    return "{}/{}/b{}/t{}/s{}".format(res["net_kind"], res["option"], res["batch_size"], res["n_threads"],
+                                      res["img_size"])
+
+
+def run_suite(net_kinds, batch_sizes, thread_list, img_sizes, options, n_warmup=5, n_repeat=20):
+    """
+    运行所有配置，模型按(模型, 分辨率, 选项)创建一次，在不同线程数和batch大小上复用
+    """
+    res_list = []
+    for net_kind, img_size, option in itertools.product(net_kinds, img_sizes, options):
+        precision = "bf16" if "bf16" in parse_option(option) else "fp32"
+        net, memory_format = build_net(net_kind, option, img_size)
+        for n_threads, batch_size in itertools.product(thread_list, batch_sizes):
+            torch.set_num_threads(n_threads)
+            elapsed = bench_one(net, batch_size, img_size, memory_format, precision, n_warmup, n_repeat)
+            res = {"net_kind": net_kind, "option": option, "batch_size": batch_size, "n_threads": n_threads,
+                   "img_size": img_size}
+            res.update(summarize(elapsed, batch_size))
+            res_list.append(res)
+            print('[Info] {:<44} p50: {:8.2f} ms, p90: {:8.2f} ms, p99: {:8.2f} ms, {:8.1f} 张/s'.format(
+                get_key(res), res["p50_ms"], res["p90_ms"], res["p99_ms"], res["throughput"]))
+    return res_list
+
+
+def compare_baseline(res_list, baseline_path, threshold=0.1):
+    """
+    与之前的结果对比p50，变慢超过threshold的配置视为回退
+    :return: 回退的配置列表
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {get_key(res): res for res in json.load(f)["results"]}
+    regressions = []
+    for res in res_list:
+        key = get_key(res)
+        if key not in baseline:
+            continue
+        ratio = res["p50_ms"] / baseline[key]["p50_ms"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = " <- 回退"
+            regressions.append(key)
+        print('[Info] {:<44} p50: {:8.2f} -> {:8.2f} ms, {:.2f}x{}'.format(
+            key, baseline[key]["p50_ms"], res["p50_ms"], ratio, flag))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='模型benchmark')
+    parser.add_argument('-k', dest='net_kinds', required=False, help='模型类型', nargs='+', default=['large', 'small'])
+    parser.add_argument('-b', dest='batch_sizes', required=False, help='batch大小', nargs='+', type=int,
+                        default=[1, 32])
+    parser.add_argument('-t', dest='thread_list', required=False, help='intra-op线程数', nargs='+', type=int,
+                        default=[torch.get_num_threads()])
+    parser.add_argument('-s', dest='img_sizes', required=False, help='输入分辨率', nargs='+', type=int, default=[224])
+    parser.add_argument('-o', dest='options', required=False, help='运行时选项, 可选{}, 用+组合'.format(
+        "/".join(RUNTIME_OPTIONS)), nargs='+', default=['fuse', 'fuse+channels_last'])
+    parser.add_argument('-w', dest='n_warmup', required=False, help='预热次数', type=int, default=5)
+    parser.add_argument('-r', dest='n_repeat', required=False, help='重复次数', type=int, default=20)
+    parser.add_argument('-j', dest='out_json', required=False, help='结果json', type=str, default='')
+    parser.add_argument('--baseline', dest='baseline', required=False, help='对比的结果json', type=str, default='')
+    parser.add_argument('--threshold', dest='threshold', required=False, help='p50变慢超过该比例视为回退', type=float,
+                        default=0.1)
+    args = parser.parse_args()
+    for option in args.options:
+        parse_option(option)
+    return args
+
+
+def main():
+    args = parse_args()
+    env_info = get_env_info()
+    print('[Info] 环境: {}'.format(env_info))
+    res_list = run_suite(args.net_kinds, args.batch_sizes, args.thread_list, args.img_sizes, args.options,
+                         n_warmup=args.n_warmup, n_repeat=args.n_repeat)
+    if args.out_json:
+        with open(args.out_json, 'w') as f:
+            json.dump({"env": env_info, "args": vars(args), "results": res_list}, f, indent=2)
+        print('[Info] 结果已保存: {}'.format(args.out_json))
+    if args.baseline:
+        regressions = compare_baseline(res_list, args.baseline, args.threshold)
+        if regressions:
+            print('[Warning] 性能回退: {}'.format(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,32 @@
+import argparse
+import json
 import os
 import random
+import time
+from multiprocessing.pool import Pool
 
+import numpy as np
+import torch
 from PIL import Image
-from torch.utils.data import Dataset
+from torch.utils.data import DataLoader, Dataset, RandomSampler, Sampler, Subset
 
 random.seed(1)
 
+IMG_EXTS = ('.jpg', '.jpeg', '.png')  # 支持的图片后缀
+IMG_INDEX_NAME = '.img_index.json'  # 图片索引缓存文件
+IMG_INDEX_VERSION = 1
+
 class flowerDataset(Dataset):
     # 自定义Dataset类，必须继承Dataset并重写__init__和__getitem__函数
-    def __init__(self, data_dir, transform=None):
+    def __init__(self, data_dir, transform=None, use_cache=True):
         """
             花朵分类任务的Dataset
             :param data_dir: str, 数据集所在路径
             :param transform: torch.transform，数据预处理，默认不进行预处理
+            :param use_cache: bool, 是否使用图片索引缓存
         """
         # data_info存储所有图片路径和标签（元组的列表），在DataLoader中通过index读取样本
-        self.data_info = self.get_img_info(data_dir)
+        self.data_info = self.get_img_info(data_dir, use_cache=use_cache)
         self.transform = transform
 
     def __getitem__(self, index):
@@ -31,22 +42,292 @@ class flowerDataset(Dataset):
         return len(self.data_info)
 
     # 自定义方法，用于返回所有图片的路径以及标签
+    # 索引缓存在data_dir/.img_index.json中，类别文件夹的mtime不变时直接复用，只重新扫描变化的类别文件夹
     @staticmethod
-    def get_img_info(data_dir):
+    def get_img_info(data_dir, use_cache=True):
+        cache_path = os.path.join(data_dir, IMG_INDEX_NAME)
+        cached_dirs = flowerDataset.load_img_index(cache_path) if use_cache else dict()
+
+        index_dirs = dict()
+        n_changed = 0
+        # 遍历类别，在该任务中，文件夹名等于标签名
+        for entry in sorted(os.scandir(data_dir), key=lambda x: x.name):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            # 文件夹中增删文件时mtime会变化
+            mtime = entry.stat().st_mtime_ns
+            cached = cached_dirs.get(entry.name)
+            if cached and cached["mtime"] == mtime:
+                index_dirs[entry.name] = cached
+                continue
+            # 一次listdir同时过滤出所有图片（那当然也就把文件夹过滤掉了）
+            img_names = sorted(x for x in os.listdir(entry.path) if x.lower().endswith(IMG_EXTS))
+            if time.time_ns() - mtime < 2 * 10 ** 9:
+                mtime = -1  # 刚修改过的文件夹，文件系统的mtime精度可能不够，下次重新扫描
+            index_dirs[entry.name] = {"mtime": mtime, "names": img_names}
+            n_changed += 1
+
+        if use_cache and (n_changed or len(index_dirs) != len(cached_dirs)):
+            print('[Info] 更新索引: {}, 变化的类别数: {}'.format(cache_path, n_changed))
+            flowerDataset.save_img_index(cache_path, index_dirs)
+
         data_info = list()
-        for root, dirs, _ in os.walk(data_dir):
-            # 遍历类别
-            for sub_dir in dirs:
-                # listdir为列出文件夹下所有文件和文件夹名
-                img_names = os.listdir(os.path.join(root, sub_dir))
-                # 过滤出所有后缀名为jpg的文件名（那当然也就把文件夹过滤掉了）
-                img_names = list(filter(lambda x: x.endswith('.jpg'), img_names))
-
-                # 遍历图片
-                for i in range(len(img_names)):
-                    img_name = img_names[i]
-                    path_img = os.path.join(root, sub_dir, img_name)
-                    # 在该任务中，文件夹名等于标签名
-                    label = sub_dir
-                    data_info.append((path_img, int(label)))
-        return data_info
\ No newline at end of file
+        for sub_dir, item in index_dirs.items():
+            label = int(sub_dir)
+            for img_name in item["names"]:
+                data_info.append((os.path.join(data_dir, sub_dir, img_name), label))
+        return data_info
+
+    @staticmethod
+    def load_img_index(cache_path):
+        if not os.path.isfile(cache_path):
+            return dict()
+        try:
+            with open(cache_path, 'r', encoding='utf8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+        if index.get("version") != IMG_INDEX_VERSION:
+            return dict()
+        return index["dirs"]
+
+    @staticmethod
+    def save_img_index(cache_path, index_dirs):
+        # 先写临时文件再替换，多个进程同时构建数据集时不会读到写了一半的文件
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                json.dump({"version": IMG_INDEX_VERSION, "dirs": index_dirs}, f, ensure_ascii=False,
+                          separators=(',', ':'))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print('[Warning] 索引写入失败: {}'.format(e))  # 只读的文件夹，不缓存
+
+
+def load_resized_img(args):
+    """
+    读取图片并缩放，与transforms.Resize((img_size, img_size))的结果一致
+    """
+    path_img, img_size = args
+    img = Image.open(path_img).convert('RGB')
+    img = img.resize((img_size, img_size), Image.BILINEAR)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def pack_dataset(data_dir, out_dir, img_size=224, num_workers=8):
+    """
+    将数据集解码、缩放后写入连续的内存映射文件，只需要执行一次
+    输出: images.npy(N, H, W, 3, uint8)、labels.npy(N, int64)、paths.txt和meta.json
+    :param data_dir: str, 数据集所在路径，与flowerDataset相同
+    :param out_dir: str, 输出路径
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    data_info = flowerDataset.get_img_info(data_dir)
+    n_img = len(data_info)
+    print('[Info] 图片数: {}, 输出: {}'.format(n_img, out_dir))
+    s_time = time.time()
+    images = np.lib.format.open_memmap(os.path.join(out_dir, 'images.npy'), mode='w+',
+                                       dtype=np.uint8, shape=(n_img, img_size, img_size, 3))
+    with Pool(processes=num_workers) as pool:
+        tasks = [(path_img, img_size) for path_img, _ in data_info]
+        for idx, img_np in enumerate(pool.imap(load_resized_img, tasks, chunksize=16)):
+            images[idx] = img_np
+            if (idx + 1) % 1000 == 0:
+                print('[Info] 已处理: {} / {}'.format(idx + 1, n_img))
+    images.flush()
+    del images
+    np.save(os.path.join(out_dir, 'labels.npy'), np.array([x[1] for x in data_info], dtype=np.int64))
+    with open(os.path.join(out_dir, 'paths.txt'), 'w', encoding='utf8') as f:
+        for path_img, _ in data_info:
+            f.write("{}\n".format(path_img))
+    meta = {"data_dir": os.path.abspath(data_dir), "num": n_img, "img_size": img_size, "time": time.time()}
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    print('[Info] 打包完成, 耗时: {:.1f}s'.format(time.time() - s_time))
+
+
+class flowerPackedDataset(Dataset):
+    # 读取pack_dataset的输出，图片已经解码和缩放，直接从内存映射文件中取
+    def __init__(self, pack_dir, transform=None):
+        """
+            打包后的Dataset
+            :param pack_dir: str, pack_dataset的输出路径
+            :param transform: 输入为HWC的uint8 numpy图像，如transforms.ToTensor()；
+                              默认不处理，返回CHW的uint8 Tensor，与文件共享内存，float转换可以放到GPU上做
+        """
+        self.pack_dir = pack_dir
+        self.transform = transform
+        self.labels = np.load(os.path.join(pack_dir, 'labels.npy'))
+        self.images = None  # 在worker进程中第一次读取时再打开，避免fork时传递mmap
+
+    def __getitem__(self, index):
+        if self.images is None:
+            # copy-on-write，得到可写的视图，不修改文件也不拷贝数据
+            self.images = np.load(os.path.join(self.pack_dir, 'images.npy'), mmap_mode='c')
+        img = self.images[index]
+        label = int(self.labels[index])
+        if self.transform is not None:
+            return self.transform(img), label
+        return torch.from_numpy(img).permute(2, 0, 1), label
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class ClassBalancedSampler(Sampler):
+    # 类别均衡采样，每个epoch每个类别采样num_per_class个样本，样本不足时重复
+    # 与expand_sample_list的效果相同，但不需要复制文件或样本列表
+    def __init__(self, labels, num_per_class, seed=47):
+        """
+            :param labels: 每个样本的标签，可以用get_labels(dataset)获取
+            :param num_per_class: int, 每个epoch每个类别的样本数
+            :param seed: int, 随机种子，每个epoch的采样不同
+        """
+        labels = np.asarray(labels)
+        self.class_indices = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+        self.num_per_class = num_per_class
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        indices = []
+        for idxes in self.class_indices:
+            # 先打乱再重复，同一类别中各样本出现的次数最多相差1
+            n_piece = self.num_per_class // len(idxes) + 1
+            x_idxes = np.concatenate([rng.permutation(idxes) for _ in range(n_piece)])
+            indices.append(x_idxes[:self.num_per_class])
+        indices = np.concatenate(indices)
+        rng.shuffle(indices)
+        return iter(indices.tolist())
+
+    def __len__(self):
+        return self.num_per_class * len(self.class_indices)
+
+
+class EpochRandomSampler(RandomSampler):
+    # 随机打乱，每个epoch的顺序只由seed + epoch决定，与ClassBalancedSampler相同
+    # 不使用全局随机数，DataLoader复用迭代器(persistent_workers)或从断点恢复时顺序不变
+    def __init__(self, data_source, seed=47):
+        super(EpochRandomSampler, self).__init__(data_source, generator=torch.Generator())
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        self.generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        return super(EpochRandomSampler, self).__iter__()
+
+
+def get_labels(dataset):
+    """
+    获取数据集的所有标签，不读取图片
+    """
+    if hasattr(dataset, "data_info"):
+        return [label for _, label in dataset.data_info]
+    return dataset.labels
+
+
+def seed_worker(worker_id):
+    """
+    DataLoader的worker_init_fn，torch已经为每个worker设置了不同的种子，numpy和random按它设置
+    """
+    worker_seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def channels_last_collate(batch):
+    """
+    DataLoader的collate_fn，图片直接拷贝到channels_last(NHWC)布局的batch中，不需要在主进程中再转换一次
+    """
+    imgs, labels = zip(*batch)
+    out = torch.empty((len(imgs),) + tuple(imgs[0].shape), dtype=imgs[0].dtype,
+                      memory_format=torch.channels_last)
+    for i, img in enumerate(imgs):
+        out[i].copy_(img)
+    return out, torch.tensor(labels, dtype=torch.int64)
+
+
+def get_loader_kwargs(num_workers=4, prefetch_factor=2, pin_memory=None, persistent_workers=True):
+    """
+    DataLoader的多进程参数，num_workers为0时只在主进程中读取
+    :param pin_memory: None时有GPU才使用锁页内存
+    """
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        kwargs.update({"prefetch_factor": prefetch_factor, "persistent_workers": persistent_workers,
+                       "worker_init_fn": seed_worker})
+    return kwargs
+
+
+def measure_loader_speed(dataset, batch_size, num_workers, prefetch_factor=2):
+    """
+    读取整个数据集一次的速度(张/s)，不包括第一个batch(启动worker)
+    """
+    kwargs = get_loader_kwargs(num_workers, prefetch_factor=prefetch_factor, persistent_workers=False)
+    data_iter = iter(DataLoader(dataset, batch_size=batch_size, shuffle=False, **kwargs))
+    next(data_iter)
+    s_time = time.time()
+    n_img = sum(len(labels) for _, labels in data_iter)
+    elapsed = time.time() - s_time
+    del data_iter
+    return n_img / max(elapsed, 1e-6)
+
+
+def autotune_num_workers(dataset, batch_size, candidates=None, n_batch=20, prefetch_factor=2, n_repeat=3, seed=47):
+    """
+    在实际的数据集上测量不同worker数的读取速度(张/s)，返回最快的worker数
+    所有候选读取相同的随机子集，先不计时地读取一遍(文件缓存)，再按交替的顺序测量n_repeat轮，取中位数
+    :param candidates: 候选的worker数，默认为0和2的幂，不超过CPU核数
+    :param n_batch: 每次测量的batch数，不包括第一个batch(启动worker)
+    :param n_repeat: 每个候选测量的次数
+    """
+    if candidates is None:
+        n_cpu = os.cpu_count() or 1
+        candidates = [0] + [2 ** i for i in range(1, 6) if 2 ** i <= n_cpu]
+    n_sample = min(len(dataset), (n_batch + 1) * batch_size)
+    indices = random.Random(seed).sample(range(len(dataset)), n_sample)
+    subset = Subset(dataset, indices)
+    measure_loader_speed(subset, batch_size, max(candidates), prefetch_factor)  # 预热，不计时
+    speed_dict = {num_workers: [] for num_workers in candidates}
+    for i in range(n_repeat):
+        # 交替正序和逆序，避免系统状态的漂移总是有利于某些候选
+        for num_workers in (candidates if i % 2 == 0 else candidates[::-1]):
+            speed_dict[num_workers].append(measure_loader_speed(subset, batch_size, num_workers, prefetch_factor))
+    speed_dict = {num_workers: float(np.median(speeds)) for num_workers, speeds in speed_dict.items()}
+    for num_workers in candidates:
+        print('[Info] num_workers: {}, 速度: {:.1f} 张/s'.format(num_workers, speed_dict[num_workers]))
+    best = max(speed_dict, key=speed_dict.get)
+    print('[Info] 最快的num_workers: {}'.format(best))
+    return best
+
+
+def parse_args():
+    """
+    处理脚本参数
+    """
+    parser = argparse.ArgumentParser(description='数据集打包')
+    parser.add_argument('-i', dest='data_dir', required=True, help='数据集文件夹', type=str)
+    parser.add_argument('-o', dest='out_dir', required=True, help='输出文件夹', type=str)
+    parser.add_argument('-s', dest='img_size', required=False, help='图片尺寸', type=int, default=224)
+    parser.add_argument('-w', dest='num_workers', required=False, help='进程数', type=int, default=8)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pack_dataset(args.data_dir, args.out_dir, img_size=args.img_size, num_workers=args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+分类评估指标: 混淆矩阵、每个类别的precision/recall/F1、置信度校准(ECE)和吞吐
+流式累加，内存与样本数无关，预测可以来自本地模型或服务
+"""
+
+import time
+
+import numpy as np
+
+
+class ClassificationMetrics(object):
+    def __init__(self, num_classes=2, n_bins=10):
+        """
+        :param num_classes: 类别数，出现更大的标签时自动扩展
+        :param n_bins: 置信度分桶数
+        """
+        self.num_classes = num_classes
+        self.n_bins = n_bins
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)  # 行为真实标签，列为预测标签
+        self.bin_count = np.zeros(n_bins, dtype=np.int64)
+        self.bin_conf = np.zeros(n_bins, dtype=np.float64)
+        self.bin_correct = np.zeros(n_bins, dtype=np.int64)
+        self.start_time = time.time()  # 从创建开始计时
+        self.last_time = self.start_time
+
+    def grow(self, num_classes):
+        confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        confusion[:self.num_classes, :self.num_classes] = self.confusion
+        self.confusion = confusion
+        self.num_classes = num_classes
+
+    def update(self, y_true, y_pred, probs=None):
+        """
+        累加一批预测
+        :param y_true: 真实标签, (N,)
+        :param y_pred: 预测标签, (N,)
+        :param probs: softmax概率, (N, C)，可选，用于校准
+        """
+        self.last_time = time.time()
+        y_true = np.asarray(y_true, dtype=np.int64).reshape(-1)
+        y_pred = np.asarray(y_pred, dtype=np.int64).reshape(-1)
+        if not y_true.size:
+            return
+        max_label = int(max(y_true.max(), y_pred.max())) + 1
+        if max_label > self.num_classes:
+            self.grow(max_label)
+        k = self.num_classes
+        self.confusion += np.bincount(y_true * k + y_pred, minlength=k * k).reshape(k, k)
+        if probs is None:
+            return
+        conf = np.asarray(probs, dtype=np.float64).reshape(len(y_true), -1).max(axis=1)
+        bins = np.minimum((conf * self.n_bins).astype(np.int64), self.n_bins - 1)
+        self.bin_count += np.bincount(bins, minlength=self.n_bins)
+        self.bin_conf += np.bincount(bins, weights=conf, minlength=self.n_bins)
+        self.bin_correct += np.bincount(bins, weights=(y_true == y_pred), minlength=self.n_bins).astype(np.int64)
+
+    def update_confusion(self, confusion):
+        """
+        累加已经统计好的混淆矩阵，如训练时在GPU上用bincount统计的结果
+        """
+        confusion = np.asarray(confusion, dtype=np.int64)
+        if len(confusion) > self.num_classes:
+            self.grow(len(confusion))
+        k = len(confusion)
+        self.confusion[:k, :k] += confusion
+
+    def count(self):
+        return int(self.confusion.sum())
+
+    def accuracy(self):
+        n = self.count()
+        return float(np.trace(self.confusion)) / n if n else 0.
+
+    def per_class(self):
+        """
+        :return: precision, recall, f1, support，都是(C,)的数组
+        """
+        tp = np.diag(self.confusion).astype(np.float64)
+        n_pred = self.confusion.sum(axis=0)
+        support = self.confusion.sum(axis=1)
+        precision = np.divide(tp, n_pred, out=np.zeros_like(tp), where=n_pred > 0)
+        recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+        pr = precision + recall
+        f1 = np.divide(2 * precision * recall, pr, out=np.zeros_like(tp), where=pr > 0)
+        return precision, recall, f1, support
+
+    def calibration(self):
+        """
+        :return: 每个桶的(样本数, 平均置信度, 准确率)，以及ECE
+        """
+        n = self.bin_count.sum()
+        mean_conf = np.divide(self.bin_conf, self.bin_count, out=np.zeros(self.n_bins), where=self.bin_count > 0)
+        acc = np.divide(self.bin_correct, self.bin_count, out=np.zeros(self.n_bins), where=self.bin_count > 0)
+        ece = float(np.sum(self.bin_count * np.abs(acc - mean_conf)) / n) if n else 0.
+        return self.bin_count, mean_conf, acc, ece
+
+    def throughput(self):
+        if self.last_time <= self.start_time:
+            return 0.
+        return self.count() / (self.last_time - self.start_time)
+
+    def summary(self, label_names=None):
+        precision, recall, f1, support = self.per_class()
+        names = [self.get_name(i, label_names) for i in range(self.num_classes)]
+        bin_count, mean_conf, acc, ece = self.calibration()
+        return {
+            "n": self.count(),
+            "accuracy": self.accuracy(),
+            "macro_f1": float(f1[support > 0].mean()) if (support > 0).any() else 0.,
+            "throughput": self.throughput(),
+            "per_class": {name: {"precision": float(p), "recall": float(r), "f1": float(f), "support": int(s)}
+                          for name, p, r, f, s in zip(names, precision, recall, f1, support)},
+            "confusion": self.confusion.tolist(),
+            "ece": ece,
+            "calibration": [{"range": [i / self.n_bins, (i + 1) / self.n_bins], "n": int(c),
+                             "confidence": float(mc), "accuracy": float(a)}
+                            for i, (c, mc, a) in enumerate(zip(bin_count, mean_conf, acc))],
+        }
+
+    @staticmethod
+    def get_name(label, label_names=None):
+        if label_names and label < len(label_names):
+            return label_names[label]
+        return str(label)
+
+    def print_report(self, label_names=None):
+        precision, recall, f1, support = self.per_class()
+        print("[Info] " + "-" * 50)
+        speed_str = ', 速度: {:.1f} 张/s'.format(self.throughput()) if self.throughput() else ''
+        print('[Info] 样本数: {}, 准确率: {:.4f}{}'.format(self.count(), self.accuracy(), speed_str))
+        for i in range(self.num_classes):
+            print('[Info] 类别: {}, precision: {:.4f}, recall: {:.4f}, f1: {:.4f}, 样本数: {}'.format(
+                self.get_name(i, label_names), precision[i], recall[i], f1[i], support[i]))
+        print('[Info] 混淆矩阵(行为真实标签, 列为预测标签):')
+        for row in self.confusion:
+            print('[Info]   {}'.format(" ".join("{:>8d}".format(x) for x in row)))
+        bin_count, mean_conf, acc, ece = self.calibration()
+        if bin_count.sum():
+            print('[Info] 校准 ECE: {:.4f}'.format(ece))
+            for i in range(self.n_bins):
+                if bin_count[i]:
+                    print('[Info]   置信度 [{:.1f}, {:.1f}): 样本数 {}, 平均置信度 {:.4f}, 准确率 {:.4f}'.format(
+                        i / self.n_bins, (i + 1) / self.n_bins, bin_count[i], mean_conf[i], acc[i]))
+        print("[Info] " + "-" * 50)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+将.pkl权重导出为TorchScript(.pt)和ONNX(.onnx)，并检查导出模型与原模型的输出是否一致
+"""
+
+import argparse
+import os
+
+import torch
+
+from model.export import export_torchscript, export_onnx, load_torchscript, OnnxRunner
+from model.model import MobileNetV3_large, MobileNetV3_small
+
+
+def check_output(net, runner, name, n_img=2):
+    x = torch.randn(n_img, 3, 224, 224)
+    with torch.no_grad():
+        diff = (net(x) - runner(x)).abs().max().item()
+    print('[Info] {} 最大误差: {}'.format(name, diff))
+
+
+def parse_args():
+    """
+    处理脚本参数
+    """
+    parser = argparse.ArgumentParser(description='模型导出')
+    parser.add_argument('-m', dest='weight_path', required=True, help='模型权重(.pkl)', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='类别数', type=int, default=2)
+    parser.add_argument('-o', dest='out_dir', required=True, help='输出文件夹', type=str)
+    parser.add_argument('-f', dest='formats', required=False, help='导出格式, 逗号分隔', type=str,
+                        default='torchscript,onnx')
+    args = parser.parse_args()
+    print('[Info] 参数: {}'.format(vars(args)))
+    return args
+
+
+def main():
+    args = parse_args()
+    net_cls = MobileNetV3_small if args.net_kind.lower() == 'small' else MobileNetV3_large
+    net = net_cls(num_classes=args.num_classes)
+    net.load_state_dict(torch.load(args.weight_path, map_location='cpu'))
+    net.eval()
+    os.makedirs(args.out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.weight_path))[0]
+    formats = args.formats.split(",")
+
+    if 'torchscript' in formats:
+        ts_path = os.path.join(args.out_dir, "{}.pt".format(name))
+        export_torchscript(net, ts_path)
+        check_output(net, load_torchscript(ts_path), 'torchscript')
+    if 'onnx' in formats:
+        onnx_path = os.path.join(args.out_dir, "{}.onnx".format(name))
+        export_onnx(net, onnx_path)
+        try:
+            check_output(net, OnnxRunner(onnx_path), 'onnxruntime')
+        except ImportError:
+            print('[Warning] 未安装onnxruntime, 跳过检查')
+
+
+if __name__ == '__main__':
+    main()
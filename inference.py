@@ -2,12 +2,20 @@ import sys
 sys.path.append('./data')
 sys.path.append('./model')
 
+import io
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 import numpy as np
 
 from torch.nn import functional as F
 import torchvision.transforms as transforms
-from model.model import MobileNetV3_large
+from model.export import load_torchscript, OnnxRunner
+from model.fuse import fuse_model
+from model.model import MobileNetV3_large, MobileNetV3_small
+from model.precision import autocast, get_precision
+from model.profiler import BlockProfiler
+from model.quantization import load_quantized
 from PIL import Image
 
 
@@ -15,54 +23,173 @@ from PIL import Image
 class Detector(object):
     # netkind为'large'或'small'可以选择加载MobileNetV3_large或MobileNetV3_small
     # 需要事先训练好对应网络的权重
-    def __init__(self, net_kind, num_classes=17):
+    # max_batch_size为一次前向的最大图片数，用于限制内存；num_workers为并行解码的线程数
+    # fuse_bn为True时，加载权重后将bn折叠进卷积
+    # backend为运行时: 'eager'加载.pkl权重，'torchscript'加载.pt，'onnxruntime'加载.onnx(需要安装onnxruntime)
+    # quantized为True时，weight_path为quantize.py导出的int8模型(TorchScript)，只能在CPU上运行
+    # precision为'fp32'、'bf16'或'fp16'，低精度时前向使用autocast(CPU上为bf16)，只支持eager
+    # channels_last为True时，模型和输入使用NHWC内存布局，depthwise和1x1卷积更快，只支持eager
+    # profile为True时，在Bottleneck和SEModule上注册hook，逐层记录耗时(self.profiler)，只支持eager；默认不注册，没有开销
+    def __init__(self, net_kind, num_classes=17, weight_path=None, max_batch_size=32, num_workers=4,
+                 fuse_bn=False, quantized=False, backend='eager', precision='fp32', channels_last=False,
+                 profile=False):
         super(Detector, self).__init__()
         kind = net_kind.lower()
         if kind == 'large':
             self.net = MobileNetV3_large(num_classes=num_classes)
         elif kind == 'small':
-            self.net = MobileNetV3_large(num_classes=num_classes)
+            self.net = MobileNetV3_small(num_classes=num_classes)
+        self.quantized = quantized
+        self.backend = 'torchscript' if quantized else backend
+        assert self.backend in ('eager', 'torchscript', 'onnxruntime'), self.backend
+        use_cuda = torch.cuda.is_available() and not quantized and self.backend != 'onnxruntime'
+        self.device = torch.device('cuda' if use_cuda else 'cpu')
+        if precision != 'fp32' and self.backend != 'eager':
+            print('[Warning] 混合精度只支持eager, 使用fp32: {}'.format(self.backend))
+            precision = 'fp32'
+        self.precision = get_precision(precision, self.device)
+        if channels_last and self.backend != 'eager':
+            print('[Warning] channels_last只支持eager: {}'.format(self.backend))
+            channels_last = False
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        if profile and self.backend != 'eager':
+            print('[Warning] profile只支持eager: {}'.format(self.backend))
+            profile = False
+        self.profile = profile
+        self.profiler = None
+        self.net.to(self.device)
         self.net.eval()
-        if torch.cuda.is_available():
-            self.net.cuda()
-
-    def load_weights(self, weight_path):
-        if torch.cuda.is_available():
-            self.net.load_state_dict(torch.load(weight_path))
-        else:
-            self.net.load_state_dict(torch.load(weight_path, map_location=torch.device('cpu')))
-
-    # 检测器主体
-    def detect(self, weight_path, pic_path):
-        # 先加载权重
-        self.load_weights(weight_path=weight_path)
-        # 读取图片
-        img = Image.open(pic_path).convert('RGB')
-        transform = transforms.Compose([
+        # 预处理只构建一次，所有预测共用
+        self.transform = transforms.Compose([
             transforms.Resize((224, 224)),
             transforms.ToTensor(),
         ])
-        img_tensor = transform(img).unsqueeze(0)
-        if torch.cuda.is_available():
-            img_tensor = img_tensor.cuda()
-        net_output = self.net(img_tensor)
-        print(net_output)
-        _, predicted = torch.max(net_output.data, 1)
-        p = F.softmax(net_output.data, dim=1).numpy()[0]
-        p = list(np.around(p, 3))
-        print("[Info] prop: {}".format(p))
-        result = predicted[0].item()
-        print("预测的结果为：", result)
+        self.fuse_bn = fuse_bn
+        self.model = self.net  # 未折叠的模型，用于加载权重
+        self.max_batch_size = max_batch_size
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.weight_path = None
+        if weight_path:
+            self.load(weight_path)
 
+    def load(self, weight_path):
+        """
+        加载权重，只需要调用一次
+        """
+        self.weight_path = weight_path
+        if self.quantized:
+            self.net = load_quantized(weight_path)
+            return
+        if self.backend == 'torchscript':
+            self.net = load_torchscript(weight_path, self.device)
+            return
+        if self.backend == 'onnxruntime':
+            self.net = OnnxRunner(weight_path)  # onnxruntime自行管理线程和设备
+            return
+        state_dict = torch.load(weight_path, map_location=self.device)
+        self.model.load_state_dict(state_dict)
+        self.model.eval()
+        self.net = fuse_model(self.model) if self.fuse_bn else self.model
+        self.net.to(memory_format=self.memory_format)
+        if self.profile:
+            if self.profiler is not None:
+                self.profiler.detach()
+            self.profiler = BlockProfiler(self.net).attach()
 
-if __name__ == '__main__':
-    detector = Detector('large', num_classes=2)
-    # detector.detect('./mydata/models/best_20210902.pkl', './mydata/document_dataset/000/000002_000.jpg')
-    detector.detect('./mydata/models/best_20210902.pkl', './mydata/document_dataset/001/000000_004.jpg')
+    def load_weights(self, weight_path):
+        self.load(weight_path)
 
+    @staticmethod
+    def read_img(image):
+        """
+        读取图像，支持图像路径、PIL图像、bytes和BGR格式的numpy图像(cv2)
+        """
+        if isinstance(image, Image.Image):
+            return image.convert('RGB')
+        if isinstance(image, (bytes, bytearray)):
+            return Image.open(io.BytesIO(image)).convert('RGB')
+        if isinstance(image, np.ndarray):
+            if image.ndim == 2:
+                return Image.fromarray(image).convert('RGB')
+            img_rgb = np.ascontiguousarray(image[:, :, 2::-1])  # BGR(A) -> RGB
+            return Image.fromarray(img_rgb)
+        return Image.open(image).convert('RGB')
 
+    def predict(self, image):
+        """
+        预测单张图像
+        :param image: 图像路径、PIL图像、bytes或BGR格式的numpy图像
+        :return: {"label": 预测类别, "prob": 各类别概率}
+        """
+        return self.predict_many([image])[0]
 
+    def predict_many(self, images):
+        """
+        预测多张图像，返回结果列表，与输入顺序一致
+        """
+        return self.predict_batch(images)
 
+    def preprocess(self, image):
+        return self.transform(self.read_img(image))
 
+    def forward(self, img_tensor):
+        """
+        一次前向，返回softmax概率，numpy格式
+        """
+        with torch.inference_mode(), autocast(self.precision, self.device):
+            net_output = self.net(img_tensor.to(self.device, memory_format=self.memory_format))
+        return F.softmax(net_output.float(), dim=1).cpu().numpy()
 
+    def predict_batch(self, images, batch_size=None, skip_errors=False):
+        """
+        批量预测，多线程并行解码和缩放，每batch_size张图像执行一次前向
+        :param images: 图像列表，元素为图像路径、PIL图像、bytes或BGR格式的numpy图像
+        :param batch_size: 单次前向的最大图片数，默认为max_batch_size
+        :param skip_errors: True时无法读取的图像结果为None，其他图像仍然批量前向；False时抛出异常
+        :return: 结果列表，与输入顺序一致
+        """
+        batch_size = batch_size or self.max_batch_size
+        images = list(images)
+        chunks = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        res_list = []
+        # 当前batch前向时，下一个batch已经在解码，只预取一个batch，内存有上限
+        futures = [self.pool.submit(self.preprocess, img) for img in chunks[0]] if chunks else []
+        for chunk_idx in range(len(chunks)):
+            tensors = []
+            for f in futures:
+                try:
+                    tensors.append(f.result())
+                except Exception as e:
+                    if not skip_errors:
+                        raise
+                    print('[Warning] 读取失败: {}'.format(e))
+                    tensors.append(None)
+            if chunk_idx + 1 < len(chunks):
+                futures = [self.pool.submit(self.preprocess, img) for img in chunks[chunk_idx + 1]]
+            ok_tensors = [t for t in tensors if t is not None]
+            probs = iter(self.forward(torch.stack(ok_tensors)) if ok_tensors else [])
+            for t in tensors:
+                if t is None:
+                    res_list.append(None)
+                    continue
+                p = next(probs)
+                res_list.append({"label": int(p.argmax()), "prob": p.tolist()})
+        return res_list
 
+    # 检测器主体
+    def detect(self, weight_path, pic_path):
+        # 权重变化时才重新加载
+        if weight_path != self.weight_path:
+            self.load(weight_path)
+        res_dict = self.predict(pic_path)
+        p = np.around(res_dict["prob"], 3).tolist()
+        print("[Info] prop: {}".format(p))
+        result = res_dict["label"]
+        print("预测的结果为：", result)
+        return result
+
+
+if __name__ == '__main__':
+    detector = Detector('large', num_classes=2, weight_path='./mydata/models/best_20210902.pkl')
+    # print(detector.predict('./mydata/document_dataset/000/000002_000.jpg'))
+    print(detector.predict('./mydata/document_dataset/001/000000_004.jpg'))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+本地推理服务，基于asyncio，将并发请求合并成micro-batch后统一前向
+
+接口: POST /predict，body为图像的原始bytes(jpg/png)
+返回: {"code": 0, "msg": "ok", "data": {"label": 类别, "prob": [各类别概率]}}
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from inference import Detector
+
+
+class MicroBatcher(object):
+    """
+    请求队列，每凑满max_batch_size张或等待超过max_wait_ms，执行一次前向
+    """
+    def __init__(self, detector, max_batch_size=32, max_wait_ms=5):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.queue = asyncio.Queue()
+        self.net_pool = ThreadPoolExecutor(max_workers=1)  # 模型只在一个线程中前向
+        self.n_batch = 0
+        self.n_img = 0
+
+    async def predict(self, img_bytes):
+        loop = asyncio.get_running_loop()
+        # 解码在检测器的线程池中并行执行，坏图只影响当前请求
+        img_tensor = await loop.run_in_executor(self.detector.pool, self.detector.preprocess, img_bytes)
+        future = loop.create_future()
+        await self.queue.put((img_tensor, future))
+        return await future
+
+    async def collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect_batch()
+            img_tensor = torch.stack([x[0] for x in batch])
+            try:
+                probs = await loop.run_in_executor(self.net_pool, self.detector.forward, img_tensor)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.n_batch += 1
+            self.n_img += len(batch)
+            for (_, future), p in zip(batch, probs):
+                if not future.done():
+                    future.set_result({"label": int(p.argmax()), "prob": p.tolist()})
+
+
+class InferenceServer(object):
+    """
+    最简HTTP/1.1服务，支持keep-alive
+    """
+    def __init__(self, detector, host="0.0.0.0", port=8866, max_batch_size=32, max_wait_ms=5):
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(detector, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.start_time = time.time()
+
+    @staticmethod
+    async def read_request(reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(" ", 2)
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, value = line.decode('latin-1').split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        body = b""
+        n_bytes = int(headers.get("content-length", 0))
+        if n_bytes:
+            body = await reader.readexactly(n_bytes)
+        return method, path, headers, body
+
+    @staticmethod
+    def write_response(writer, status, res_dict, keep_alive=True):
+        body = json.dumps(res_dict).encode('utf8')
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}[status]
+        header = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n" \
+                 "Connection: {}\r\n\r\n".format(status, reason, len(body), "keep-alive" if keep_alive else "close")
+        writer.write(header.encode('latin-1') + body)
+
+    async def handle_request(self, method, path, body):
+        if method == "POST" and path == "/predict":
+            try:
+                res = await self.batcher.predict(body)
+            except Exception as e:
+                return 400, {"code": 1, "msg": str(e), "data": {}}
+            return 200, {"code": 0, "msg": "ok", "data": res}
+        if method == "GET" and path == "/health":
+            data = {"n_batch": self.batcher.n_batch, "n_img": self.batcher.n_img,
+                    "uptime": time.time() - self.start_time}
+            return 200, {"code": 0, "msg": "ok", "data": data}
+        return 404, {"code": 1, "msg": "not found", "data": {}}
+
+    async def handle_conn(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, res_dict = await self.handle_request(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.write_response(writer, status, res_dict, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        batch_task = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle_conn, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]  # port为0时使用随机端口
+        print('[Info] 服务启动: http://{}:{}/predict'.format(self.host, self.port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+def parse_args():
+    """
+    处理脚本参数
+    """
+    parser = argparse.ArgumentParser(description='本地推理服务')
+    parser.add_argument('-m', dest='weight_path', required=True, help='模型权重', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='类别数', type=int, default=2)
+    parser.add_argument('--host', dest='host', required=False, help='地址', type=str, default='0.0.0.0')
+    parser.add_argument('--port', dest='port', required=False, help='端口', type=int, default=8866)
+    parser.add_argument('-b', dest='max_batch_size', required=False, help='最大batch', type=int, default=32)
+    parser.add_argument('-w', dest='max_wait_ms', required=False, help='最长等待(毫秒)', type=float, default=5)
+    parser.add_argument('-r', dest='backend', required=False, help='运行时, eager/torchscript/onnxruntime',
+                        type=str, default='eager')
+    parser.add_argument('-t', dest='num_workers', required=False, help='解码线程数', type=int, default=4)
+    args = parser.parse_args()
+    print('[Info] 参数: {}'.format(vars(args)))
+    return args
+
+
+def main():
+    args = parse_args()
+    detector = Detector(args.net_kind, num_classes=args.num_classes, weight_path=args.weight_path,
+                        max_batch_size=args.max_batch_size, num_workers=args.num_workers, backend=args.backend)
+    server = InferenceServer(detector, host=args.host, port=args.port,
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+分类服务压测，基于asyncio
+- 闭环(closed): 固定并发数，每个连接收到返回后立即发下一个请求
+- 开环(open): 按固定QPS发请求，与返回速度无关，耗时从计划的发送时间开始计算
+输出吞吐、p50/p90/p99/p999和错误率
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from myutils.project_utils import traverse_dir_files
+
+
+class LatencyHistogram(object):
+    """
+    对数分桶的耗时直方图，相对误差约1%，内存与请求数无关
+    """
+    def __init__(self, precision=0.01):
+        self.log_base = math.log(1. + precision)
+        self.buckets = dict()
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+    def record(self, latency):
+        """
+        :param latency: 耗时(秒)
+        """
+        idx = int(math.log(max(latency, 1e-6) * 1e6) / self.log_base)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += latency
+        self.min = min(self.min, latency)
+        self.max = max(self.max, latency)
+
+    def percentile(self, q):
+        """
+        :param q: 百分位，如99.9
+        :return: 耗时(秒)
+        """
+        if not self.count:
+            return 0.
+        rank = math.ceil(self.count * q / 100.)
+        n = 0
+        for idx in sorted(self.buckets.keys()):
+            n += self.buckets[idx]
+            if n >= rank:
+                # 取桶的中点
+                return min(math.exp((idx + 0.5) * self.log_base) / 1e6, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+
+class HttpConnection(object):
+    """
+    keep-alive的HTTP/1.1连接，支持Content-Length、chunked和读到连接关闭的返回
+    服务端返回Connection: close或HTTP/1.0(没有keep-alive)时，读完返回后关闭，下一个请求重新建立连接
+    """
+    def __init__(self, host, port, ssl=False):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.reader = None
+        self.writer = None
+
+    async def post(self, path, body):
+        """
+        复用的连接可能已经被服务端关闭(如空闲超时)，没有收到任何返回时重新建立连接再发送一次
+        :return: 状态码, 返回的body
+        """
+        if self.writer is not None:
+            try:
+                return await self.request(path, body)
+            except ConnectionError:
+                self.close()
+        return await self.request(path, body)
+
+    async def request(self, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        header = "POST {} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/octet-stream\r\n" \
+                 "Content-Length: {}\r\n\r\n".format(path, self.host, self.port, len(body))
+        self.writer.write(header.encode('latin-1') + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("连接已关闭")
+        version, status = status_line.split()[:2]
+        status = int(status)
+        headers = dict()
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, value = line.decode('latin-1').split(":", 1)
+            headers[key.strip().lower()] = value.strip().lower()
+        connection = headers.get("connection", "")
+        keep_alive = "keep-alive" in connection if version == b"HTTP/1.0" else "close" not in connection
+        if status in (204, 304):
+            res_body = b""
+        elif "chunked" in headers.get("transfer-encoding", ""):
+            res_body = await self.read_chunked()
+        elif "content-length" in headers:
+            res_body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            res_body = await self.reader.read()  # 没有长度时，body到连接关闭为止
+            keep_alive = False
+        if not keep_alive:
+            self.close()
+        return status, res_body
+
+    async def read_chunked(self):
+        chunks = []
+        while True:
+            size_line = await self.reader.readline()
+            if not size_line:
+                raise asyncio.IncompleteReadError(b"".join(chunks), None)
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                break
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)  # chunk后的\r\n
+        while True:
+            # trailer，以空行结束
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+        return b"".join(chunks)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class LoadTester(object):
+    def __init__(self, service_url, payloads, timeout=10):
+        url = urlsplit(service_url)
+        if url.scheme not in ("http", "https"):
+            raise ValueError("不支持的服务地址: {}".format(service_url))
+        self.host = url.hostname
+        self.ssl = url.scheme == "https"
+        self.port = url.port or (443 if self.ssl else 80)
+        self.path = url.path or "/"
+        self.payloads = payloads
+        self.timeout = timeout
+        self.hist = LatencyHistogram()
+        self.n_error = 0
+        self.idle_conns = []
+
+    async def send(self, conn, start_time=None):
+        """
+        发送一个请求并记录耗时，开环时start_time为计划的发送时间
+        """
+        body = random.choice(self.payloads)
+        start_time = start_time or time.perf_counter()
+        try:
+            status, res_body = await asyncio.wait_for(conn.post(self.path, body), self.timeout)
+            ok = status == 200 and json.loads(res_body).get("code", 0) == 0
+        except (asyncio.TimeoutError, OSError, ValueError, asyncio.IncompleteReadError):
+            conn.close()  # 连接状态未知，重新建立
+            ok = False
+        self.hist.record(time.perf_counter() - start_time)
+        if not ok:
+            self.n_error += 1
+
+    async def run_closed(self, concurrency, duration):
+        """
+        闭环: concurrency个连接，每个连接串行发请求
+        """
+        end_time = time.perf_counter() + duration
+
+        async def worker():
+            conn = HttpConnection(self.host, self.port, self.ssl)
+            while time.perf_counter() < end_time:
+                await self.send(conn)
+            conn.close()
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    async def run_open(self, qps, duration, max_conns=1024, poisson=True):
+        """
+        开环: 按qps安排发送时间，poisson为True时间隔服从指数分布，否则均匀
+        """
+        loop = asyncio.get_running_loop()
+        s_time = time.perf_counter()
+        tasks = set()
+        sem = asyncio.Semaphore(max_conns)
+
+        async def one_request(scheduled):
+            async with sem:
+                conn = self.idle_conns.pop() if self.idle_conns else HttpConnection(self.host, self.port, self.ssl)
+                await self.send(conn, start_time=scheduled)
+                self.idle_conns.append(conn)
+
+        next_time = s_time
+        while next_time < s_time + duration:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = loop.create_task(one_request(next_time))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_time += random.expovariate(qps) if poisson else 1. / qps
+        if tasks:
+            await asyncio.gather(*tasks)
+        for conn in self.idle_conns:
+            conn.close()
+
+    def report(self, elapsed):
+        hist = self.hist
+        res = {
+            "n_request": hist.count,
+            "n_error": self.n_error,
+            "error_rate": self.n_error / hist.count if hist.count else 0.,
+            "throughput": hist.count / elapsed if elapsed else 0.,
+            "mean_ms": hist.mean() * 1000,
+            "min_ms": (hist.min if hist.count else 0.) * 1000,
+            "max_ms": hist.max * 1000,
+        }
+        for q in [50, 90, 99, 99.9]:
+            res["p{}_ms".format(str(q).replace(".", ""))] = hist.percentile(q) * 1000
+        return res
+
+    def run(self, mode, concurrency=16, qps=100., duration=30., warmup=3.):
+        async def main():
+            if warmup > 0:
+                await self.run_closed(min(concurrency, 4), warmup)
+                self.hist = LatencyHistogram()
+                self.n_error = 0
+            s_time = time.perf_counter()
+            if mode == "closed":
+                await self.run_closed(concurrency, duration)
+            else:
+                await self.run_open(qps, duration)
+            return time.perf_counter() - s_time
+        elapsed = asyncio.run(main())
+        return self.report(elapsed)
+
+
+def load_payloads(in_folder, max_num=200):
+    paths_list, _ = traverse_dir_files(in_folder, ext=['.jpg', '.jpeg', '.png'])
+    random.seed(47)
+    random.shuffle(paths_list)
+    payloads = []
+    for path in paths_list[:max_num]:
+        with open(path, 'rb') as f:
+            payloads.append(f.read())
+    print('[Info] 请求图像数: {}'.format(len(payloads)))
+    return payloads
+
+
+def start_local_server(weight_path, net_kind, num_classes, port, extra_args=""):
+    """
+    启动本地推理服务(inference_server.py)作为被测服务
+    """
+    import requests
+    server_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inference_server.py")
+    cmd = [sys.executable, server_py, "-m", weight_path, "-k", net_kind, "-n", str(num_classes),
+           "--host", "127.0.0.1", "--port", str(port)] + extra_args.split()
+    proc = subprocess.Popen(cmd)
+    health_url = "http://127.0.0.1:{}/health".format(port)
+    for _ in range(600):
+        try:
+            requests.get(health_url, timeout=1)
+            return proc, "http://127.0.0.1:{}/predict".format(port)
+        except Exception:
+            if proc.poll() is not None:
+                raise RuntimeError("本地服务启动失败")
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("本地服务启动超时")
+
+
+def parse_args():
+    """
+    处理脚本参数
+    """
+    parser = argparse.ArgumentParser(description='服务压测')
+    parser.add_argument('-i', dest='in_folder', required=True, help='请求图像文件夹', type=str)
+    parser.add_argument('-s', dest='service', required=False, help='服务地址, 如http://127.0.0.1:8866/predict', type=str)
+    parser.add_argument('--mode', dest='mode', required=False, help='closed或open', type=str, default='closed')
+    parser.add_argument('-c', dest='concurrency', required=False, help='闭环并发数', type=int, default=16)
+    parser.add_argument('-q', dest='qps', required=False, help='开环QPS', type=float, default=100)
+    parser.add_argument('-d', dest='duration', required=False, help='压测时长(秒)', type=float, default=30)
+    parser.add_argument('-w', dest='warmup', required=False, help='预热时长(秒)', type=float, default=3)
+    parser.add_argument('-o', dest='out_json', required=False, help='结果json', type=str, default='')
+    # 不指定服务时，启动本地推理服务
+    parser.add_argument('-m', dest='weight_path', required=False, help='本地服务的模型权重', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='本地服务的模型类型', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='本地服务的类别数', type=int, default=2)
+    parser.add_argument('--port', dest='port', required=False, help='本地服务端口', type=int, default=8867)
+    parser.add_argument('--server-args', dest='server_args', required=False, help='本地服务的其他参数, 如"-b 16 -w 5"',
+                        type=str, default='')
+    args = parser.parse_args()
+    if not args.service and not args.weight_path:
+        parser.error('需要指定服务地址(-s)或本地服务的模型权重(-m)')
+    print('[Info] 参数: {}'.format(vars(args)))
+    return args
+
+
+def main():
+    args = parse_args()
+    payloads = load_payloads(args.in_folder)
+    proc = None
+    service = args.service
+    if not service:
+        proc, service = start_local_server(args.weight_path, args.net_kind, args.num_classes, args.port,
+                                           args.server_args)
+    try:
+        tester = LoadTester(service, payloads)
+        res = tester.run(args.mode, concurrency=args.concurrency, qps=args.qps,
+                         duration=args.duration, warmup=args.warmup)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    res.update({"mode": args.mode, "concurrency": args.concurrency, "qps": args.qps, "service": service})
+    print("[Info] " + "-" * 50)
+    print('[Info] 请求数: {}, 错误率: {:.4f}, 吞吐: {:.1f} req/s'.format(
+        res["n_request"], res["error_rate"], res["throughput"]))
+    print('[Info] 耗时(ms) mean: {:.2f}, p50: {:.2f}, p90: {:.2f}, p99: {:.2f}, p999: {:.2f}, max: {:.2f}'.format(
+        res["mean_ms"], res["p50_ms"], res["p90_ms"], res["p99_ms"], res["p999_ms"], res["max_ms"]))
+    print("[Info] " + "-" * 50)
+    if args.out_json:
+        with open(args.out_json, 'w') as f:
+            json.dump(res, f, indent=2)
+        print('[Info] 结果已保存: {}'.format(args.out_json))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+训练断点: 保存和恢复模型、优化器、epoch、随机数状态和最优指标，由一个线程异步写入
+"""
+
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+
+def to_cpu(obj):
+    """
+    递归复制到CPU，得到与训练状态无关的快照，训练继续修改参数也不影响
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def get_rng_state():
+    rng_state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        rng_state["cuda"] = torch.cuda.get_rng_state_all()
+    return rng_state
+
+
+def set_rng_state(rng_state):
+    """
+    随机数状态必须是CPU上的ByteTensor，断点加载到GPU上时也可以恢复
+    """
+    random.setstate(rng_state["python"])
+    np.random.set_state(rng_state["numpy"])
+    torch.set_rng_state(rng_state["torch"].cpu())
+    if "cuda" in rng_state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([state.cpu() for state in rng_state["cuda"]])
+
+
+def save_atomic(obj, out_path):
+    """
+    先写临时文件再替换，中断时不会留下损坏的文件
+    """
+    tmp_path = out_path + ".tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, out_path)
+
+
+def load_checkpoint(ckpt_path, net, optimizer=None, map_location='cpu'):
+    """
+    恢复断点，返回断点字典，其中epoch为已经完成的epoch数
+    map_location默认为cpu，load_state_dict会把参数和优化器状态复制到模型所在的device
+    """
+    ckpt = torch.load(ckpt_path, map_location=map_location, weights_only=False)
+    net.load_state_dict(ckpt["model"])
+    if optimizer is not None and "optimizer" in ckpt:
+        optimizer.load_state_dict(ckpt["optimizer"])
+    if "rng" in ckpt:
+        set_rng_state(ckpt["rng"])
+    print('[Info] 断点已恢复: {}, epoch: {}, best: {}'.format(ckpt_path, ckpt["epoch"], ckpt.get("best_metric")))
+    return ckpt
+
+
+class CheckpointWriter(object):
+    """
+    在主线程中复制状态到CPU，在写入线程中保存，训练不等待磁盘
+    队列长度为1，上一个断点没有写完时才会等待，内存中最多两份快照
+    """
+    def __init__(self, max_pending=1):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, obj, out_path):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((to_cpu(obj), out_path))
+
+    def save_checkpoint(self, out_path, net, optimizer, epoch, best_metric, **kwargs):
+        ckpt = {
+            "model": net.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "epoch": epoch,
+            "best_metric": best_metric,
+            "rng": get_rng_state(),
+        }
+        ckpt.update(kwargs)
+        self.save(ckpt, out_path)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            obj, out_path = item
+            try:
+                save_atomic(obj, out_path)
+            except Exception as e:
+                print('[Warning] 保存失败: {}, {}'.format(out_path, e))
+                self.error = e
+
+    def close(self):
+        """
+        等待所有断点写完
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+导出TorchScript/ONNX模型，以及对应的加载方法
+"""
+
+import inspect
+
+import numpy as np
+import torch
+
+from model.fuse import fuse_model
+
+
+def export_torchscript(net, out_path, img_size=224):
+    """
+    折叠bn后trace，再freeze，导出的模型不依赖Python代码
+    """
+    net = fuse_model(net.cpu().eval())
+    example = torch.randn(1, 3, img_size, img_size)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(net, example))
+    torch.jit.save(traced, out_path)
+    print('[Info] TorchScript已保存: {}'.format(out_path))
+
+
+def export_onnx(net, out_path, img_size=224, opset_version=13):
+    """
+    导出ONNX，batch维度是动态的
+    """
+    net = fuse_model(net.cpu().eval())
+    example = torch.randn(1, 3, img_size, img_size)
+    kwargs = dict()
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False  # 使用基于TorchScript的导出器，不依赖onnxscript
+    torch.onnx.export(net, example, out_path, input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+                      opset_version=opset_version, **kwargs)
+    print('[Info] ONNX已保存: {}'.format(out_path))
+
+
+def load_torchscript(model_path, device='cpu'):
+    net = torch.jit.load(model_path, map_location=device)
+    net.eval()
+    return net
+
+
+class OnnxRunner(object):
+    """
+    onnxruntime推理，输入输出都是torch.Tensor，与nn.Module的调用方式一致
+    """
+    def __init__(self, model_path, num_threads=0):
+        import onnxruntime as ort  # 可选依赖
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = [p for p in ['CUDAExecutionProvider', 'CPUExecutionProvider']
+                     if p in ort.get_available_providers()]
+        self.session = ort.InferenceSession(model_path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, img_tensor):
+        img_np = np.ascontiguousarray(img_tensor.detach().cpu().numpy(), dtype=np.float32)
+        out = self.session.run(None, {self.input_name: img_np})[0]
+        return torch.from_numpy(out)
+
+    def eval(self):
+        return self
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+推理时将BatchNorm折叠进前面的卷积，减少kernel数量和访存，数值上与原模型等价
+"""
+
+import copy
+
+import torch
+import torch.nn as nn
+
+from model.model import Bottleneck, MobileNetV3_large, MobileNetV3_small
+
+
+def fuse_conv_bn(conv, bn):
+    """
+    合并conv和bn，返回带bias的卷积
+    w' = w * gamma / sqrt(var + eps)
+    b' = (b - mean) * gamma / sqrt(var + eps) + beta
+    """
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True)
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return fused.to(conv.weight.device)
+
+
+def fuse_pair(module, conv_name, bn_name):
+    """
+    合并module中的conv和bn，bn替换为Identity，forward不用修改
+    """
+    conv, bn = getattr(module, conv_name), getattr(module, bn_name)
+    setattr(module, conv_name, fuse_conv_bn(conv, bn))
+    setattr(module, bn_name, nn.Identity())
+
+
+def fuse_model(net, inplace=False):
+    """
+    折叠MobileNetV3_large/MobileNetV3_small中所有的conv+bn，只能用于推理
+    """
+    if not inplace:
+        net = copy.deepcopy(net)
+    net.eval()
+    fuse_pair(net, 'conv1', 'bn1')
+    fuse_pair(net, 'conv2', 'bn2')
+    for block in net.modules():
+        if not isinstance(block, Bottleneck):
+            continue
+        fuse_pair(block, 'conv1', 'bn1')
+        fuse_pair(block, 'conv2', 'bn2')
+        fuse_pair(block, 'conv3', 'bn3')
+        if len(block.shortcut) == 2:
+            block.shortcut = nn.Sequential(fuse_conv_bn(block.shortcut[0], block.shortcut[1]))
+    return net
+
+
+def check_fuse(net_cls, n_img=4):
+    """
+    对比折叠前后的输出，bn使用随机统计量，避免恒等变换掩盖错误
+    """
+    net = net_cls(num_classes=3)
+    for m in net.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+            nn.init.uniform_(m.weight, 0.5, 1.5)
+            nn.init.uniform_(m.bias, -0.5, 0.5)
+    net.eval()
+    fused_net = fuse_model(net)
+    n_bn = sum(isinstance(m, nn.BatchNorm2d) for m in fused_net.modules())
+    x = torch.randn(n_img, 3, 224, 224)
+    with torch.no_grad():
+        y = net(x)
+        y_fused = fused_net(x)
+    diff = (y - y_fused).abs().max().item()
+    print('[Info] {}, 剩余bn: {}, 最大误差: {}'.format(net_cls.__name__, n_bn, diff))
+    assert n_bn == 0
+    assert torch.allclose(y, y_fused, rtol=1e-3, atol=1e-4)
+
+
+if __name__ == '__main__':
+    check_fuse(MobileNetV3_large)
+    check_fuse(MobileNetV3_small)
@@ -2,11 +2,14 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+# Hswish(x) = x * relu6(x + 3) / 6，Hsigmoid(x) = relu6(x + 3) / 6
+# 使用F.hardswish/F.hardsigmoid实现，数值相同，量化时可以直接映射为int8算子
+# inplace只作用于中间结果，这里保留参数以兼容旧的调用方式
 def Hswish(x,inplace=True):
-    return x * F.relu6(x + 3., inplace=inplace) / 6.
+    return F.hardswish(x)
 
 def Hsigmoid(x,inplace=True):
-    return F.relu6(x + 3., inplace=inplace) / 6.
+    return F.hardsigmoid(x)
 
 
 # Squeeze-And-Excite模块
@@ -109,18 +112,28 @@ class MobileNetV3_large(nn.Module):
             in_channels=out_channels
         return nn.Sequential(*layers)
 
-    def forward(self,x):
+    def forward_features(self,x):
+        # 骨干网络，输出池化后的特征，(N,960,1,1)
         out=Hswish(self.bn1(self.conv1(x)))
         out=self.layers(out)
         out=Hswish(self.bn2(self.conv2(out)))
-        out=F.avg_pool2d(out,7)
-        out=Hswish(self.conv3(out))
+        # 全局平均池化，224输入时特征图为7x7，与avg_pool2d(out,7)相同，其他分辨率也可以使用
+        out=F.adaptive_avg_pool2d(out,1)
+        return out
+
+    def forward_head(self,feat):
+        # 分类头，输入(N,960)或(N,960,1,1)的特征
+        feat=feat.view(feat.size(0),feat.size(1),1,1)
+        out=Hswish(self.conv3(feat))
         out=self.conv4(out)
         # 因为原论文中最后一层是卷积层来实现全连接的效果，维度是四维的，后两维是1，在计算损失函数的时候要求二维，因此在这里需要做一个resize
         a,b=out.size(0),out.size(1)
         out=out.view(a,b)
         return out
 
+    def forward(self,x):
+        return self.forward_head(self.forward_features(x))
+
 class MobileNetV3_small(nn.Module):
     # (out_channels,kernel_size,exp_channels,stride,se,nl)
     cfg = [
@@ -144,6 +157,7 @@ class MobileNetV3_small(nn.Module):
         self.layers = self._make_layers(in_channels=16)
         self.conv2=nn.Conv2d(96,576,1,stride=1,bias=False)
         self.bn2=nn.BatchNorm2d(576)
+        self.se=SEModule(576)
         # 卷积后不跟BN，就应该把bias设置为True
         self.conv3=nn.Conv2d(576,1280,1,1,padding=0,bias=True)
         self.conv4=nn.Conv2d(1280,num_classes,1,stride=1,padding=0,bias=True)
@@ -157,20 +171,67 @@ class MobileNetV3_small(nn.Module):
             in_channels=out_channels
         return nn.Sequential(*layers)
 
-    def forward(self,x):
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
+                              missing_keys, unexpected_keys, error_msgs):
+        # 旧版本的se在forward中随机创建，权重中没有se层，使用初始化的参数补齐
+        se_state = self.se.state_dict(prefix=prefix + 'se.')
+        missing_se = [key for key in se_state if key not in state_dict]
+        if missing_se:
+            print('[Warning] 权重中缺少se层, 使用随机初始化: {}'.format(missing_se))
+            for key in missing_se:
+                state_dict[key] = se_state[key]
+        super(MobileNetV3_small, self)._load_from_state_dict(
+            state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs)
+
+    def forward_features(self,x):
+        # 骨干网络，输出池化后的特征，(N,576,1,1)
         out=Hswish(self.bn1(self.conv1(x)))
         out=self.layers(out)
         out=self.bn2(self.conv2(out))
-        se=SEModule(out.size(1))
-        out=Hswish(se(out))
-        out = F.avg_pool2d(out, 7)
-        out = Hswish(self.conv3(out))
+        out=Hswish(self.se(out))
+        out = F.adaptive_avg_pool2d(out, 1)
+        return out
+
+    def forward_head(self,feat):
+        # 分类头，输入(N,576)或(N,576,1,1)的特征
+        feat = feat.view(feat.size(0), feat.size(1), 1, 1)
+        out = Hswish(self.conv3(feat))
         out = self.conv4(out)
         # 因为原论文中最后一层是卷积层来实现全连接的效果，维度是四维的，后两维是1，在计算损失函数的时候要求二维，因此在这里需要做一个resize
         a, b = out.size(0), out.size(1)
         out = out.view(a, b)
         return out
 
+    def forward(self,x):
+        return self.forward_head(self.forward_features(x))
+
+
+def check_global_pool(net_cls, n_img=2):
+    """
+    224输入时，adaptive_avg_pool2d(out,1)与原来的avg_pool2d(out,7)输出相同；其他分辨率输出(N,C,1,1)
+    """
+    net = net_cls(num_classes=3).eval()
+    # 池化前的最后一个模块，池化的输入为Hswish(该模块的输出)
+    last = net.bn2 if net_cls is MobileNetV3_large else net.se
+    feats = []
+    handle = last.register_forward_hook(lambda m, inputs, output: feats.append(output))
+    with torch.no_grad():
+        y = net.forward_features(torch.randn(n_img, 3, 224, 224))
+        y_old = F.avg_pool2d(Hswish(feats[-1]), 7)
+        y_320 = net.forward_features(torch.randn(n_img, 3, 320, 320))
+    handle.remove()
+    diff = (y - y_old).abs().max().item()
+    print('[Info] {}, 池化前: {}, 最大误差: {}, 320输入: {}'.format(
+        net_cls.__name__, tuple(feats[0].shape), diff, tuple(y_320.shape)))
+    assert feats[0].shape[2:] == (7, 7)
+    assert torch.allclose(y, y_old, rtol=0, atol=1e-6)
+    assert y_320.shape == y.shape
+
+
+if __name__ == '__main__':
+    check_global_pool(MobileNetV3_large)
+    check_global_pool(MobileNetV3_small)
+
 
 # def test():
 #     net=MobileNetV3_small()
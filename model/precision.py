@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+混合精度: 基于autocast，CPU上使用bf16，GPU上可以使用fp16
+卷积和全连接以低精度计算，softmax和loss等仍为fp32，权重保持fp32
+python -m model.precision -m weights/best.pkl -n 2 -i data/val 对比fp32和低精度的输出
+"""
+
+import argparse
+import contextlib
+import time
+
+import torch
+
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+AUTOCAST_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def get_precision(precision, device):
+    """
+    检查精度，CPU上fp16很慢，改为bf16
+    """
+    assert precision in PRECISIONS, precision
+    if precision == 'fp16' and torch.device(device).type != 'cuda':
+        print('[Warning] CPU不支持高效的fp16, 使用bf16')
+        return 'bf16'
+    return precision
+
+
+def autocast(precision, device):
+    """
+    前向计算的上下文，fp32时不做任何处理
+    """
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=AUTOCAST_DTYPES[precision])
+
+
+def get_grad_scaler(precision, device):
+    """
+    fp16训练时需要缩放loss，避免梯度下溢；bf16的指数范围与fp32相同，不需要
+    """
+    enabled = precision == 'fp16' and torch.device(device).type == 'cuda'
+    return torch.amp.GradScaler('cuda', enabled=enabled)
+
+
+def check_precision(net, images, precision, device, batch_size=32, n_repeat=3):
+    """
+    对比fp32和低精度的logits
+    :param images: (N, 3, H, W)的图像tensor
+    :return: 统计结果
+    """
+    net = net.to(device).eval()
+    res = dict()
+    logits_dict = dict()
+    for p in ('fp32', precision):
+        elapsed = []
+        for _ in range(n_repeat):
+            s_time = time.time()
+            outs = []
+            with torch.inference_mode(), autocast(p, device):
+                for i in range(0, len(images), batch_size):
+                    outs.append(net(images[i:i + batch_size].to(device)).float().cpu())
+            elapsed.append(time.time() - s_time)
+        logits_dict[p] = torch.cat(outs)
+        res["{}_speed".format(p)] = len(images) / min(elapsed)  # 取最快的一次，第一次包含预热
+    y, y_low = logits_dict['fp32'], logits_dict[precision]
+    diff = (y - y_low).abs()
+    prob_diff = (torch.softmax(y, dim=1) - torch.softmax(y_low, dim=1)).abs()
+    res.update({
+        "n": len(images),
+        "logit_max_diff": diff.max().item(),
+        "logit_mean_diff": diff.mean().item(),
+        "prob_max_diff": prob_diff.max().item(),
+        "top1_agreement": (y.argmax(dim=1) == y_low.argmax(dim=1)).float().mean().item(),
+    })
+    return res
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='对比fp32和混合精度的输出')
+    parser.add_argument('-m', dest='weight_path', required=True, help='模型权重', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='类别数', type=int, default=2)
+    parser.add_argument('-i', dest='img_folder', required=True, help='验证集文件夹', type=str)
+    parser.add_argument('-p', dest='precision', required=False, help='bf16或fp16', type=str, default='bf16')
+    parser.add_argument('--max-num', dest='max_num', required=False, help='最多使用的图片数', type=int, default=512)
+    return parser.parse_args()
+
+
+def main():
+    from inference import Detector
+    from myutils.project_utils import traverse_dir_files
+
+    args = parse_args()
+    detector = Detector(args.net_kind, num_classes=args.num_classes, weight_path=args.weight_path)
+    paths_list, _ = traverse_dir_files(args.img_folder, ext=['.jpg', '.jpeg', '.png'])
+    paths_list = paths_list[:args.max_num]
+    images = torch.stack(list(detector.pool.map(detector.preprocess, paths_list)))
+    precision = get_precision(args.precision, detector.device)
+    res = check_precision(detector.model, images, precision, detector.device)
+    print('[Info] 图片数: {}, 精度: {}'.format(res["n"], precision))
+    print('[Info] logits 最大误差: {:.5f}, 平均误差: {:.5f}, 概率最大误差: {:.5f}, top1一致率: {:.4f}'.format(
+        res["logit_max_diff"], res["logit_mean_diff"], res["prob_max_diff"], res["top1_agreement"]))
+    print('[Info] 速度 fp32: {:.1f} 张/s, {}: {:.1f} 张/s'.format(
+        res["fp32_speed"], precision, res["{}_speed".format(precision)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+逐层profile: 在Bottleneck和SEModule上注册forward hook，记录每次调用的耗时、输出大小和激活内存
+激活内存为模块内所有算子新分配的tensor存储之和，包括Hswish、SE的乘法和残差相加等函数式算子，
+view、in-place算子和nn.Identity(折叠bn后)不分配新的存储，不计入
+输出汇总表和Chrome trace(chrome://tracing 或 https://ui.perfetto.dev 打开)
+只在attach之后注册hook，detach后完全移除，不使用时没有额外开销
+汇总在每次调用时累加，只保留最近max_events个事件用于trace，长时间profile内存不会增长
+python -m model.profiler -k large -b 8 -o trace.json
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_leaves
+
+from model.model import Bottleneck, SEModule, MobileNetV3_large, MobileNetV3_small
+
+
+def get_tensor_bytes(output):
+    if torch.is_tensor(output):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(get_tensor_bytes(x) for x in output)
+    return 0
+
+
+def get_storage_ptr(tensor):
+    try:
+        return tensor.untyped_storage().data_ptr()
+    except (NotImplementedError, RuntimeError):
+        return None  # 没有存储的tensor，如稀疏tensor
+
+
+class ActivationCounter(TorchDispatchMode):
+    """
+    统计每个算子新分配的存储，累加到当前线程正在执行的最内层模块
+    输出的存储与某个输入相同时(view或in-place)不计入
+    """
+    def __init__(self, stack):
+        super(ActivationCounter, self).__init__()
+        self.stack = stack
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        out = func(*args, **kwargs)
+        if self.stack:
+            seen_ptrs = set(get_storage_ptr(x) for x in tree_leaves((args, kwargs)) if torch.is_tensor(x))
+            for x in tree_leaves(out):
+                if not torch.is_tensor(x):
+                    continue
+                ptr = get_storage_ptr(x)
+                if ptr is None or ptr in seen_ptrs:
+                    continue
+                seen_ptrs.add(ptr)
+                self.stack[-1][2] += x.untyped_storage().nbytes()
+        return out
+
+
+class BlockProfiler(object):
+    """
+    用法:
+        profiler = BlockProfiler(net).attach()
+        net(x)
+        profiler.print_table()
+        profiler.save_chrome_trace("trace.json")
+        profiler.detach()
+    或者 with BlockProfiler(net) as profiler: ...
+    """
+    def __init__(self, net, module_types=(Bottleneck, SEModule), sync_cuda=True, max_events=100000,
+                 track_memory=True):
+        """
+        :param net: 模型，根模块也会记录，作为总耗时
+        :param module_types: 需要记录的模块类型
+        :param sync_cuda: GPU上每个模块前后同步，耗时才准确
+        :param max_events: Chrome trace保留的最近事件数，不影响汇总
+        :param track_memory: 是否统计激活内存，每个算子多一次Python调用，耗时略有增加；False时激活为0
+        """
+        self.net = net
+        self.module_types = module_types
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.track_memory = track_memory
+        self.names = OrderedDict()  # 模块 -> 名称
+        self.names[net] = net.__class__.__name__
+        for name, m in net.named_modules():
+            if name and isinstance(m, module_types):
+                self.names[m] = "{}({})".format(name, m.__class__.__name__)
+        self.handles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.max_events = max_events
+        self.events = deque(maxlen=max_events)  # (名称, 开始ns, 耗时ns, 输出bytes, 激活bytes, 线程id, 深度)
+        self.stats = OrderedDict()  # 名称 -> 累加的汇总
+        self.stacks = []  # 所有线程的调用栈，reset时清空
+        self.start_ns = time.perf_counter_ns()
+
+    def get_stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+            with self.lock:
+                self.stacks.append(stack)
+        return stack
+
+    def enter_counter(self, stack):
+        self.exit_counter()
+        if self.track_memory:
+            self.local.counter = ActivationCounter(stack)
+            self.local.counter.__enter__()
+
+    def exit_counter(self):
+        counter = getattr(self.local, "counter", None)
+        if counter is not None:
+            self.local.counter = None
+            counter.__exit__(None, None, None)
+
+    def pre_hook(self, module, inputs):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        stack = self.get_stack()
+        if module is self.net:
+            stack.clear()  # 上一次前向异常中断时，未结束的模块留在栈中
+        if not stack:
+            self.enter_counter(stack)  # 最外层的模块开始时统计激活，结束时停止
+        # [模块, 开始时间, 激活bytes]
+        stack.append([module, time.perf_counter_ns(), 0])
+
+    def post_hook(self, module, inputs, output):
+        """
+        注册时always_call=True，前向抛出异常时也会调用，此时output为None，只出栈不记录
+        """
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        end_ns = time.perf_counter_ns()
+        stack = self.get_stack()
+        # 弹出到当前模块，丢弃异常中断的子模块
+        while stack and stack[-1][0] is not module:
+            stack.pop()
+        if not stack:
+            return
+        _, s_ns, act_bytes = stack.pop()
+        if stack:
+            stack[-1][2] += act_bytes  # 子模块的激活也属于父模块
+        else:
+            self.exit_counter()
+        if output is None:
+            return
+        out_bytes = get_tensor_bytes(output)
+        name, dur_ns, depth = self.names[module], end_ns - s_ns, len(stack)
+        with self.lock:
+            self.events.append((name, s_ns, dur_ns, out_bytes, act_bytes, threading.get_ident(), depth))
+            item = self.stats.get(name, None)
+            if item is None:
+                item = self.stats[name] = {"name": name, "depth": depth, "calls": 0, "total_ns": 0,
+                                           "out_bytes": 0, "act_bytes": 0}
+            item["calls"] += 1
+            item["total_ns"] += dur_ns
+            item["out_bytes"] += out_bytes
+            item["act_bytes"] += act_bytes
+
+    def attach(self):
+        if self.handles:
+            return self
+        for m in self.names:
+            self.handles.append(m.register_forward_pre_hook(self.pre_hook))
+            self.handles.append(m.register_forward_hook(self.post_hook, always_call=True))
+        if self.track_memory:
+            with ActivationCounter([]):
+                torch.zeros(1) + 1  # 第一次进入dispatch mode有一次性的初始化开销，不计入第一个模块的耗时
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.exit_counter()
+
+    def reset(self):
+        with self.lock:
+            self.events = deque(maxlen=self.max_events)
+            self.stats = OrderedDict()
+            for stack in self.stacks:
+                stack.clear()
+        self.start_ns = time.perf_counter_ns()
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.detach()
+
+    def aggregate(self):
+        """
+        按模块汇总，顺序与模型中的顺序相同
+        :return: [{name, depth, calls, total_ms, mean_ms, pct, out_bytes, act_bytes}, ...]
+        """
+        with self.lock:
+            stats = {name: dict(item) for name, item in self.stats.items()}
+        root_ms = stats.get(self.names[self.net], {}).get("total_ns", 0) / 1e6
+        res_list = []
+        for name in self.names.values():
+            item = stats.get(name, None)
+            if item is None:
+                continue
+            calls = item["calls"]
+            item["total_ms"] = item.pop("total_ns") / 1e6
+            item["mean_ms"] = item["total_ms"] / calls
+            item["pct"] = 100. * item["total_ms"] / root_ms if root_ms else 0.
+            item["out_bytes"] //= calls
+            item["act_bytes"] //= calls
+            res_list.append(item)
+        return res_list
+
+    def print_table(self, sort_by=None, top_k=0):
+        """
+        :param sort_by: None时按模型顺序，否则按该字段降序，如"total_ms"
+        """
+        res_list = self.aggregate()
+        if sort_by:
+            root_name = self.names[self.net]
+            res_list = [x for x in res_list if x["name"] != root_name]
+            res_list = sorted(res_list, key=lambda x: x[sort_by], reverse=True)
+        if top_k:
+            res_list = res_list[:top_k]
+        print('[Info] {:<36} {:>6} {:>10} {:>9} {:>7} {:>11} {:>11}'.format(
+            "模块", "调用", "总耗时ms", "平均ms", "占比%", "输出KB", "激活KB"))
+        for item in res_list:
+            name = "  " * item["depth"] + item["name"] if not sort_by else item["name"]
+            print('[Info] {:<38} {:>6} {:>12.2f} {:>10.3f} {:>8.1f} {:>12.1f} {:>12.1f}'.format(
+                name, item["calls"], item["total_ms"], item["mean_ms"], item["pct"],
+                item["out_bytes"] / 1024, item["act_bytes"] / 1024))
+        if self.track_memory:
+            print('[Info] 激活: 模块内算子新分配的存储, 包括函数式算子, 不包括view和in-place')
+        else:
+            print('[Info] 激活: 未统计(track_memory=False)')
+        return res_list
+
+    def save_chrome_trace(self, out_path):
+        """
+        保存为Chrome trace格式，每个调用是一个完整事件(ph=X)，时间单位为微秒，只包含最近max_events个事件
+        """
+        trace_events = []
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        for name, s_ns, dur_ns, out_bytes, act_bytes, tid, depth in events:
+            trace_events.append({"name": name, "cat": "module", "ph": "X", "pid": pid, "tid": tid,
+                                 "ts": (s_ns - self.start_ns) / 1e3, "dur": dur_ns / 1e3,
+                                 "args": {"out_bytes": out_bytes, "act_bytes": act_bytes}})
+        with open(out_path, 'w') as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+        print('[Info] Chrome trace已保存: {}, 事件数: {}'.format(out_path, len(trace_events)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='逐层profile')
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-b', dest='batch_size', required=False, help='batch大小', type=int, default=8)
+    parser.add_argument('-s', dest='img_size', required=False, help='输入分辨率', type=int, default=224)
+    parser.add_argument('-r', dest='n_repeat', required=False, help='重复次数', type=int, default=10)
+    parser.add_argument('-o', dest='out_path', required=False, help='Chrome trace文件', type=str, default='')
+    parser.add_argument('--no-memory', dest='track_memory', action='store_false', help='不统计激活内存, 耗时更准确')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    net = (MobileNetV3_small if args.net_kind == "small" else MobileNetV3_large)(num_classes=2).eval()
+    x = torch.randn(args.batch_size, 3, args.img_size, args.img_size)
+    with torch.inference_mode():
+        net(x)  # 预热，不记录
+        with BlockProfiler(net, track_memory=args.track_memory) as profiler:
+            for _ in range(args.n_repeat):
+                net(x)
+    profiler.print_table()
+    print('[Info] 最耗时的模块:')
+    profiler.print_table(sort_by="total_ms", top_k=6)
+    if args.out_path:
+        profiler.save_chrome_trace(args.out_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+训练后静态量化(int8)，流程: 插入observer -> 校准 -> 转换，只支持CPU
+"""
+
+import copy
+
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+def get_quant_backend():
+    """
+    x86服务器优先使用x86(fbgemm + onednn)，ARM使用qnnpack
+    """
+    engines = torch.backends.quantized.supported_engines
+    for backend in ['x86', 'fbgemm', 'qnnpack']:
+        if backend in engines:
+            return backend
+    raise RuntimeError('当前PyTorch不支持量化: {}'.format(engines))
+
+
+def prepare_model(net, backend=None, img_size=224):
+    """
+    插入observer，conv+bn会在这一步自动合并
+    """
+    backend = backend or get_quant_backend()
+    torch.backends.quantized.engine = backend
+    net = copy.deepcopy(net).cpu().eval()
+    example_inputs = (torch.randn(1, 3, img_size, img_size),)
+    return prepare_fx(net, get_default_qconfig_mapping(backend), example_inputs)
+
+
+def calibrate(prepared_net, data_loader, n_batch=10):
+    """
+    使用少量真实图像统计激活的分布
+    """
+    with torch.no_grad():
+        for batch_idx, (img, _) in enumerate(data_loader):
+            if batch_idx >= n_batch:
+                break
+            prepared_net(img)
+    return prepared_net
+
+
+def quantize_model(net, data_loader, n_batch=10, backend=None):
+    """
+    完整的训练后静态量化，返回int8模型
+    """
+    prepared_net = prepare_model(net, backend=backend)
+    calibrate(prepared_net, data_loader, n_batch=n_batch)
+    return convert_fx(prepared_net)
+
+
+def save_quantized(q_net, out_path, img_size=224):
+    """
+    量化模型保存为冻结的TorchScript，加载时不需要模型代码
+    """
+    example = torch.randn(1, 3, img_size, img_size)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(q_net.eval(), example))
+    torch.jit.save(traced, out_path)
+    print('[Info] 量化模型已保存: {}'.format(out_path))
+
+
+def load_quantized(model_path):
+    torch.backends.quantized.engine = get_quant_backend()
+    net = torch.jit.load(model_path, map_location='cpu')
+    net.eval()
+    return net
@@ -48,7 +48,7 @@ def make_html_page(html_file, img_data_list, n=1):
             for item in items:
                 item = str(item)
                 f.write('<td>\n')
-                if item.startswith("http"):
+                if item.startswith("http") or item.lower().endswith((".jpg", ".jpeg", ".png")):
                     f.write('<img src="%s" width="600">\n' % item)
                 else:
                     f.write('%s' % item)
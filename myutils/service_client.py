@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+本地推理服务(inference_server.py)的客户端，只依赖cv2和requests，不导入torch和模型
+"""
+
+import cv2
+import requests
+
+
+def get_local_service_np(img_np, service_url, timeout=10):
+    """
+    调用本地推理服务，返回格式与get_vpf_service_np一致
+    """
+    _, img_buf = cv2.imencode('.jpg', img_np)
+    response = requests.post(service_url, data=img_buf.tobytes(), timeout=timeout)
+    return response.json()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+对比minidom和流式解析annotations.xml的耗时和内存，使用合成的CVAT标注文件
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import resource
+import sys
+import time
+import xml.dom.minidom
+from multiprocessing.pool import Pool
+
+p = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if p not in sys.path:
+    sys.path.append(p)
+
+from preprocess.data_processer import SampleLabeledParser
+
+LABELS = ["纸质文档", "拍摄电脑屏幕", "精美生活照", "不确定的类别", "手机截屏", "卡证"]
+
+
+def make_annotations(out_path, size_mb):
+    """
+    生成CVAT格式的标注文件，每张图像有若干个points，大小约为size_mb
+    """
+    random.seed(47)
+    n_bytes = size_mb * 1024 * 1024
+    with open(out_path, 'w', encoding='utf8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<annotations>\n  <version>1.1</version>\n')
+        f.write('  <meta>\n    <task>\n      <name>doc_clz</name>\n      <labels>\n')
+        for label in LABELS:
+            f.write('        <label>\n          <name>{}</name>\n        </label>\n'.format(label))
+        f.write('      </labels>\n    </task>\n  </meta>\n')
+        img_idx = 0
+        while f.tell() < n_bytes:
+            f.write('  <image id="{}" name="img_{}.jpg" width="1080" height="1920">\n'.format(img_idx, img_idx))
+            for _ in range(random.randint(1, 4)):
+                pnts = ";".join("{:.2f},{:.2f}".format(random.uniform(0, 1080), random.uniform(0, 1920))
+                                for _ in range(random.randint(4, 16)))
+                f.write('    <points label="{}" occluded="0" source="manual" points="{}" z_order="0">\n'
+                        '    </points>\n'.format(random.choice(LABELS), pnts))
+            f.write('  </image>\n')
+            img_idx += 1
+        f.write('</annotations>\n')
+    print('[Info] 生成完成: {}, 图像数: {}, 大小: {:.1f}MB'.format(
+        out_path, img_idx, os.path.getsize(out_path) / 1024 / 1024))
+
+
+def parse_minidom(label_path):
+    """
+    原来的实现，整个文件读入DOM
+    """
+    DOMTree = xml.dom.minidom.parse(label_path)
+    collection = DOMTree.documentElement
+    for image in collection.getElementsByTagName("image"):
+        img_label = ""
+        for points in image.getElementsByTagName("points"):
+            img_label = points.getAttribute("label")
+        yield image.getAttribute("name"), img_label
+
+
+def run_parser(args):
+    """
+    在子进程中运行，返回耗时、峰值内存(MB)和结果的摘要
+    """
+    method, label_path = args
+    parse_func = parse_minidom if method == "minidom" else SampleLabeledParser.iter_annotations
+    s_time = time.time()
+    md5 = hashlib.md5()
+    n_img = 0
+    for image_name, img_label in parse_func(label_path):
+        md5.update("{}\t{}\n".format(image_name, img_label).encode('utf8'))
+        n_img += 1
+    elapsed = time.time() - s_time
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux下单位为KB
+    return method, elapsed, max_rss, n_img, md5.hexdigest()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='标注解析benchmark')
+    parser.add_argument('-o', dest='out_path', required=False, help='合成的标注文件',
+                        type=str, default='/tmp/annotations_bench.xml')
+    parser.add_argument('-s', dest='size_mb', required=False, help='文件大小(MB)', type=int, default=300)
+    parser.add_argument('--skip-minidom', dest='skip_minidom', action='store_true', help='不运行minidom, 内存不够时使用')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.out_path) or os.path.getsize(args.out_path) < args.size_mb * 1024 * 1024:
+        make_annotations(args.out_path, args.size_mb)
+    methods = ["iterparse"] if args.skip_minidom else ["iterparse", "minidom"]
+    res_list = []
+    for method in methods:
+        # 每种方法一个新进程，峰值内存互不影响
+        with Pool(processes=1) as pool:
+            res = pool.apply(run_parser, ((method, args.out_path),))
+        print('[Info] {}: 耗时 {:.2f}s, 峰值内存 {:.1f}MB, 图像数 {}'.format(*res[:4]))
+        res_list.append(res)
+    if len(res_list) == 2:
+        assert res_list[0][3:] == res_list[1][3:], "解析结果不一致"
+        print('[Info] 结果一致, 加速: {:.2f}x, 内存: {:.2f}x'.format(
+            res_list[1][1] / res_list[0][1], res_list[1][2] / res_list[0][2]))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,19 @@
 Copyright (c) 2021. All rights reserved.
 Created by C. L. Wang on 26.8.21
 """
+import io
 import os
 import sys
-from multiprocessing.pool import Pool
 
-import cv2
-import xml.dom.minidom
+import xml.etree.ElementTree as ET
 
 p = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if p not in sys.path:
     sys.path.append(p)
 
 from myutils.project_utils import *
+from preprocess.download_manifest import DownloadManifest
+from preprocess.url_downloader import UrlDownloader
 from root_dir import DATA_DIR
 
 
@@ -86,44 +87,43 @@ class SampleLabeledParser(object):
             url_dict[img_name] = data_line
         return url_dict
 
+    @staticmethod
+    def iter_annotations(label_path):
+        """
+        流式解析CVAT导出的annotations.xml，逐个返回(图像名, 标签)
+        处理完的image节点立即清理，内存占用与文件大小无关
+        """
+        context = ET.iterparse(label_path, events=("start", "end"))
+        _, root = next(context)  # 根节点annotations
+        for event, elem in context:
+            if event != "end" or elem.tag != "image":
+                continue
+            img_label = ""
+            for points in elem.iter("points"):
+                img_label = points.get("label")
+            yield elem.get("name"), img_label
+            root.clear()  # 释放已处理的image节点
+
     def process_annotations(self):
         """
         处理解析标签
         """
         label_dict = {"纸质文档": 0, "拍摄电脑屏幕": 1, "精美生活照": 2, "不确定的类别": 3, "手机截屏": 4, "卡证": 5}
-        DOMTree = xml.dom.minidom.parse(self.label_path)
-        collection = DOMTree.documentElement
-        meta = collection.getElementsByTagName("meta")
-        # print('[Info] meta: {}'.format(meta))
-        image_data = collection.getElementsByTagName("image")
-        print('[Info] 样本数: {}'.format(len(image_data)))
         url_dict = self.parse_urls_dict()
 
-        anno_list = []  # 标签信息列表
+        n_anno = 0
         label_list = []
-        for image in image_data:
-            image_name = image.getAttribute("name")
-            # print('[Info] image: {}'.format(image_name))
-            img_url = url_dict[image_name]
-            # print("[Info] img_url: {}".format(img_url))
-            points_data = image.getElementsByTagName("points")
-            # print('[Info] points_data: {}'.format(len(points_data)))
-            img_label = ""
-            for points in points_data:
-                img_label = points.getAttribute("label")
-            # print('[Info] img_url: {}, img_label: {}'.format(img_url, img_label))
-            # img_anno_dict = {
-            #     "image_name": img_url,
-            #     "image_label": label_dict[img_label]
-            # }
-            # label_list.append(img_label)
-            # img_anno_str = json.dumps(img_anno_dict)
-            anno_list.append("{}\t{}".format(img_url, label_dict[img_label]))
+        # 边解析边写，一次打开文件，缓冲写入
+        with io.open(self.out_labeled, "a+", encoding='utf8', buffering=1024 * 1024) as fs:
+            for image_name, img_label in self.iter_annotations(self.label_path):
+                img_url = url_dict[image_name]
+                fs.write("{}\t{}\n".format(img_url, label_dict[img_label]))
+                n_anno += 1
+        print('[Info] 样本数: {}'.format(n_anno))
 
         label_list = list(set(label_list))
         write_list_to_file(self.out_label_list, label_list)
-        print('[Info] 标签数量: {}'.format(len(anno_list)))
-        write_list_to_file(self.out_labeled, anno_list)
+        print('[Info] 标签数量: {}'.format(n_anno))
         print('[Info] 标签文本写入完成: {}'.format(self.out_labeled))
 
     def analyze_dataset(self):
@@ -139,34 +139,54 @@ class SampleLabeledParser(object):
         print("data_dict: {}".format(data_dict))
 
     @staticmethod
-    def process_data(data_idx, url, label, dataset_dir, data_type=""):
+    def get_out_path(data_idx, label, dataset_dir, data_type=""):
+        """
+        样本的输出路径
+        """
         # 根据数据集，设置数据量
         label_str = str(str(label).zfill(3))
         if data_type:
             out_label_dir = os.path.join(dataset_dir, label_str)
-        else:
-            out_label_dir = dataset_dir
-        mkdir_if_not_exist(out_label_dir)
-
-        _, img_bgr = download_url_img(url)
-        if data_type:
             out_name = "{}_{}_{}.jpg".format(data_type, str(data_idx).zfill(6), str(str(label).zfill(3)))
         else:
+            out_label_dir = dataset_dir
             out_name = "{}_{}.jpg".format(str(data_idx).zfill(6), str(str(label).zfill(3)))
+        return os.path.join(out_label_dir, out_name)
 
-        out_path = os.path.join(out_label_dir, out_name)
-        cv2.imwrite(out_path, img_bgr)
-        print('[Info] label: {}, idx: {}'.format(label_str, data_idx))
+    @staticmethod
+    def download_tasks(tasks, manifest_path="", n_threads=64, max_in_flight=512):
+        """
+        下载(url, 输出路径)列表，连接复用，直接保存原始图像bytes
+        manifest_path不为空时记录下载结果，重跑时跳过已完成的url，相同内容的图像只保存一次
+        """
+        downloader = UrlDownloader(n_threads=n_threads, max_in_flight=max_in_flight)
+        if not manifest_path:
+            return downloader.download(tasks)
+        manifest = DownloadManifest(manifest_path)
+        try:
+            return downloader.download(tasks, manifest=manifest)
+        finally:
+            manifest.close()
+
+    @staticmethod
+    def get_label_file(name, balanced=False):
+        """
+        下载使用的label文件，默认为split_samples输出的不重复样本
+        balanced=True时使用balance_samples复制后的文件(旧流程)，重复的url只会被跳过
+        """
+        if balanced:
+            name = "{}_balanced".format(name)
+        return os.path.join(DATA_DIR, "files", "{}.txt".format(name))
 
-    def make_dataset(self):
-        train_file_name = os.path.join(DATA_DIR, "files", "out_labeled_urls_train_balanced.txt")
+    def make_dataset(self, balanced=False):
+        train_file_name = self.get_label_file("out_labeled_urls_train", balanced)
         print('[Info] label文件: {}'.format(train_file_name))
         train_dir = os.path.join(DATA_DIR, "document_dataset_mini", "train")
         mkdir_if_not_exist(train_dir)
         train_lines = read_file(train_file_name)
         print('[Info] 样本数: {}'.format(len(train_lines)))
 
-        val_file_name = os.path.join(DATA_DIR, "files", "out_labeled_urls_val_balanced.txt")
+        val_file_name = self.get_label_file("out_labeled_urls_val", balanced)
         print('[Info] label文件: {}'.format(val_file_name))
         val_dir = os.path.join(DATA_DIR, "document_dataset_mini", "val")
         mkdir_if_not_exist(val_dir)
@@ -175,48 +195,50 @@ class SampleLabeledParser(object):
 
         train_label_dict = collections.defaultdict(int)
         val_label_dict = collections.defaultdict(int)
-        pool = Pool(processes=100)
+        tasks = []
         for data_idx, data_line in enumerate(train_lines):
             url, label = data_line.split("\t")
             if train_label_dict[label] == 16:
                 continue
-            pool.apply_async(SampleLabeledParser.process_data, (data_idx, url, label, train_dir, "train"))
+            tasks.append((url, SampleLabeledParser.get_out_path(data_idx, label, train_dir, "train")))
             train_label_dict[label] += 1
 
         for data_idx, data_line in enumerate(val_lines):
             url, label = data_line.split("\t")
             if val_label_dict[label] == 16:
                 continue
-            pool.apply_async(SampleLabeledParser.process_data, (data_idx, url, label, val_dir, "val"))
+            tasks.append((url, SampleLabeledParser.get_out_path(data_idx, label, val_dir, "val")))
             val_label_dict[label] += 1
 
-        pool.close()
-        pool.join()
+        manifest_path = os.path.join(DATA_DIR, "files", "document_dataset_mini_manifest.jsonl")
+        self.download_tasks(tasks, manifest_path=manifest_path)
         print('[Info] 全部写入完成: {}'.format(train_dir))
 
-    def make_dataset_v2(self):
-        out_file_name = os.path.join(DATA_DIR, "files", "out_labeled_urls_balanced.txt")
+    def make_dataset_v2(self, balanced=False):
+        out_file_name = self.get_label_file("out_labeled_urls", balanced)
         print('[Info] label文件: {}'.format(out_file_name))
         out_dir = os.path.join(DATA_DIR, "document_dataset_v2_2")
         mkdir_if_not_exist(out_dir)
         train_lines = read_file(out_file_name)
         print('[Info] 样本数: {}'.format(len(train_lines)))
 
-        pool = Pool(processes=100)
-        for data_idx, data_line in enumerate(train_lines):
-            url, label = data_line.split("\t")
-            pool.apply_async(SampleLabeledParser.process_data, (data_idx, url, label, out_dir))
-        pool.close()
-        pool.join()
+        def gen_tasks():
+            for data_idx, data_line in enumerate(train_lines):
+                url, label = data_line.split("\t")
+                yield url, SampleLabeledParser.get_out_path(data_idx, label, out_dir)
+
+        manifest_path = os.path.join(DATA_DIR, "files", "document_dataset_v2_2_manifest.jsonl")
+        self.download_tasks(gen_tasks(), manifest_path=manifest_path)
         print('[Info] 全部写入完成: {}'.format(out_dir))
 
-    def balance_samples(self):
-        file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls.txt")
-        train_file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls_train_balanced.txt")
-        val_file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls_val_balanced.txt")
+    @staticmethod
+    def split_label_file(file_path):
+        """
+        按类别划分训练集和验证集，每个类别的前10%为验证集
+        """
         print("[Info] 文件路径: {}".format(file_path))
         data_lines = read_file(file_path)
-        print("[Info] 样本数: {}".format(file_path))
+        print("[Info] 样本数: {}".format(len(data_lines)))
         img_label_dict = collections.defaultdict(list)
         for data_line in data_lines:
             img_url, img_label = data_line.split("\t")
@@ -231,6 +253,40 @@ class SampleLabeledParser(object):
             gap = len(samples) // 10
             val_dict[img_label] = samples[0:gap]
             train_dict[img_label] = samples[gap:]
+        return train_dict, val_dict
+
+    @staticmethod
+    def write_label_dict(file_path, label_dict):
+        print_data_dict(label_dict)
+        out_list = []
+        for img_label in label_dict.keys():
+            samples = label_dict[img_label]
+            for sample in samples:
+                out_list.append("{}\t{}".format(sample, img_label))
+        print('[Info] 样本数: {}'.format(len(out_list)))
+        write_list_to_file(file_path, out_list)
+        print('[Info] 写入完成: {}'.format(file_path))
+
+    def split_samples(self):
+        """
+        只划分训练集和验证集，不复制样本
+        训练时使用dataset.ClassBalancedSampler做类别均衡，下载量和磁盘占用不随均衡的倍数增加
+        """
+        file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls.txt")
+        train_file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls_train.txt")
+        val_file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls_val.txt")
+        train_dict, val_dict = self.split_label_file(file_path)
+        self.write_label_dict(train_file_path, train_dict)
+        self.write_label_dict(val_file_path, val_dict)
+
+    def balance_samples(self):
+        """
+        复制样本，使每个类别的样本数相同，新数据集建议使用split_samples
+        """
+        file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls.txt")
+        train_file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls_train_balanced.txt")
+        val_file_path = os.path.join(DATA_DIR, "files", "out_labeled_urls_val_balanced.txt")
+        train_dict, val_dict = self.split_label_file(file_path)
 
         num = 20000
         for img_label in train_dict.keys():
@@ -244,26 +300,8 @@ class SampleLabeledParser(object):
             samples = expand_sample_list(samples, num)
             val_dict[img_label] = samples
 
-        print_data_dict(train_dict)
-        out_list = []
-        for img_label in train_dict.keys():
-            samples = train_dict[img_label]
-            for sample in samples:
-                out_list.append("{}\t{}".format(sample, img_label))
-        print('[Info] 样本数: {}'.format(len(out_list)))
-        write_list_to_file(train_file_path, out_list)
-        print('[Info] 写入完成: {}'.format(train_file_path))
-
-        print_data_dict(val_dict)
-        out_list = []
-        for img_label in val_dict.keys():
-            samples = val_dict[img_label]
-            for sample in samples:
-                out_list.append("{}\t{}".format(sample, img_label))
-        print('[Info] 样本数: {}'.format(len(out_list)))
-        write_list_to_file(val_file_path, out_list)
-        print('[Info] 写入完成: {}'.format(val_file_path))
-
+        self.write_label_dict(train_file_path, train_dict)
+        self.write_label_dict(val_file_path, val_dict)
 
 def main():
     slp = SampleLabeledParser()
@@ -11,18 +11,19 @@ Created by C. L. Wang on 15.9.21
 Copyright (c) 2021. All rights reserved.
 Created by C. L. Wang on 26.8.21
 """
+import io
 import os
 import sys
-from multiprocessing.pool import Pool
 
-import cv2
-import xml.dom.minidom
+import xml.etree.ElementTree as ET
 
 p = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if p not in sys.path:
     sys.path.append(p)
 
 from myutils.project_utils import *
+from preprocess.download_manifest import DownloadManifest
+from preprocess.url_downloader import UrlDownloader
 from root_dir import DATA_DIR
 
 
@@ -93,44 +94,43 @@ class SampleLabeledParser(object):
             url_dict[img_name] = data_line
         return url_dict
 
+    @staticmethod
+    def iter_annotations(label_path):
+        """
+        流式解析CVAT导出的annotations.xml，逐个返回(图像名, 标签)
+        处理完的image节点立即清理，内存占用与文件大小无关
+        """
+        context = ET.iterparse(label_path, events=("start", "end"))
+        _, root = next(context)  # 根节点annotations
+        for event, elem in context:
+            if event != "end" or elem.tag != "image":
+                continue
+            img_label = ""
+            for points in elem.iter("points"):
+                img_label = points.get("label")
+            yield elem.get("name"), img_label
+            root.clear()  # 释放已处理的image节点
+
     def process_annotations(self):
         """
         处理解析标签
         """
         label_dict = {"纸质文档": 0, "拍摄电脑屏幕": 1, "精美生活照": 2, "不确定的类别": 3, "手机截屏": 4, "卡证": 5}
-        DOMTree = xml.dom.minidom.parse(self.label_path)
-        collection = DOMTree.documentElement
-        meta = collection.getElementsByTagName("meta")
-        # print('[Info] meta: {}'.format(meta))
-        image_data = collection.getElementsByTagName("image")
-        print('[Info] 样本数: {}'.format(len(image_data)))
         url_dict = self.parse_urls_dict()
 
-        anno_list = []  # 标签信息列表
+        n_anno = 0
         label_list = []
-        for image in image_data:
-            image_name = image.getAttribute("name")
-            # print('[Info] image: {}'.format(image_name))
-            img_url = url_dict[image_name]
-            # print("[Info] img_url: {}".format(img_url))
-            points_data = image.getElementsByTagName("points")
-            # print('[Info] points_data: {}'.format(len(points_data)))
-            img_label = ""
-            for points in points_data:
-                img_label = points.getAttribute("label")
-            # print('[Info] img_url: {}, img_label: {}'.format(img_url, img_label))
-            # img_anno_dict = {
-            #     "image_name": img_url,
-            #     "image_label": label_dict[img_label]
-            # }
-            # label_list.append(img_label)
-            # img_anno_str = json.dumps(img_anno_dict)
-            anno_list.append("{}\t{}".format(img_url, label_dict[img_label]))
+        # 边解析边写，一次打开文件，缓冲写入
+        with io.open(self.out_labeled, "a+", encoding='utf8', buffering=1024 * 1024) as fs:
+            for image_name, img_label in self.iter_annotations(self.label_path):
+                img_url = url_dict[image_name]
+                fs.write("{}\t{}\n".format(img_url, label_dict[img_label]))
+                n_anno += 1
+        print('[Info] 样本数: {}'.format(n_anno))
 
         label_list = list(set(label_list))
         write_list_to_file(self.out_label_list, label_list)
-        print('[Info] 标签数量: {}'.format(len(anno_list)))
-        write_list_to_file(self.out_labeled, anno_list)
+        print('[Info] 标签数量: {}'.format(n_anno))
         print('[Info] 标签文本写入完成: {}'.format(self.out_labeled))
 
     def analyze_dataset(self):
@@ -146,7 +146,10 @@ class SampleLabeledParser(object):
         print("data_dict: {}".format(data_dict))
 
     @staticmethod
-    def process_data(data_idx, url, label, dataset_dir):
+    def get_out_path(data_idx, label, dataset_dir):
+        """
+        样本的输出路径
+        """
         if data_idx < 1000:
             dataset_dir = os.path.join(dataset_dir, "test")
         elif 1000 <= data_idx < 2000:
@@ -156,16 +159,10 @@ class SampleLabeledParser(object):
 
         if label == "0":
             label_str = str(str(0).zfill(3))
-            out_label_dir = os.path.join(dataset_dir, label_str)
-            mkdir_if_not_exist(out_label_dir)
         else:
             label_str = str(str(1).zfill(3))
-            out_label_dir = os.path.join(dataset_dir, label_str)
-            mkdir_if_not_exist(out_label_dir)
-        _, img_bgr = download_url_img(url)
-        out_name = os.path.join(out_label_dir, "{}_{}.jpg".format(str(data_idx).zfill(6), str(str(label).zfill(3))))
-        cv2.imwrite(out_name, img_bgr)
-        print('[Info] label: {}, idx: {}'.format(label_str, data_idx))
+        out_label_dir = os.path.join(dataset_dir, label_str)
+        return os.path.join(out_label_dir, "{}_{}.jpg".format(str(data_idx).zfill(6), str(str(label).zfill(3))))
 
     def make_dataset(self):
         file_name = os.path.join(DATA_DIR, "files", "out_labeled_urls.txt")
@@ -174,14 +171,19 @@ class SampleLabeledParser(object):
         mkdir_if_not_exist(dataset_dir)
         data_lines = read_file(file_name)
         print('[Info] 样本数: {}'.format(len(data_lines)))
-        pool = Pool(processes=100)
-        for data_idx, data_line in enumerate(data_lines):
-            url, label = data_line.split("\t")
-            pool.apply_async(SampleLabeledParser.process_data, (data_idx, url, label, dataset_dir))
-        pool.close()
-        pool.join()
-        print('[Info] 全部写入完成: {}'.format(dataset_dir))
 
+        def gen_tasks():
+            for data_idx, data_line in enumerate(data_lines):
+                url, label = data_line.split("\t")
+                yield url, SampleLabeledParser.get_out_path(data_idx, label, dataset_dir)
+
+        # 连接复用，直接保存原始图像bytes；记录下载结果，重跑时跳过已完成的url
+        manifest = DownloadManifest(os.path.join(DATA_DIR, "files", "document_dataset_manifest.jsonl"))
+        try:
+            UrlDownloader(n_threads=64, max_in_flight=512).download(gen_tasks(), manifest=manifest)
+        finally:
+            manifest.close()
+        print('[Info] 全部写入完成: {}'.format(dataset_dir))
 
 def main():
     slp = SampleLabeledParser()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+下载记录，用于断点续传和按内容去重
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+
+
+class DownloadManifest(object):
+    """
+    jsonl格式，每完成一个url追加一行: {"url", "status", "md5", "size", "path"}
+    status: ok 已写入path; dup 内容与已有图像相同，path为已有图像; fail 下载失败，重跑时重试
+    """
+    def __init__(self, manifest_path, flush_interval=100):
+        self.manifest_path = manifest_path
+        self.flush_interval = flush_interval
+        self.records = dict()  # url -> 记录
+        self.md5_paths = dict()  # md5 -> 图像路径
+        self.claimed = set()  # 本次运行中登记的md5，图像可能还在写入，不检查文件是否存在
+        self.lock = threading.Lock()
+        self.n_unflushed = 0
+        self.load()
+        if os.path.dirname(manifest_path):
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        self.fs = io.open(manifest_path, "a", encoding='utf8')
+
+    def load(self):
+        if not os.path.isfile(self.manifest_path):
+            return
+        with io.open(self.manifest_path, "r", encoding='utf8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 中断时最后一行可能没有写完
+                self.records[record["url"]] = record
+                if record["status"] == "ok":
+                    self.md5_paths.setdefault(record["md5"], record["path"])
+        n_done = sum(1 for url in self.records if self.is_done(url))
+        print('[Info] 下载记录: {}, 已完成: {}'.format(self.manifest_path, n_done))
+
+    def is_done(self, url):
+        record = self.records.get(url, None)
+        if not record or record["status"] not in ("ok", "dup"):
+            return False
+        return os.path.exists(record["path"])  # 图像被删除时重新下载
+
+    @staticmethod
+    def get_md5(data):
+        return hashlib.md5(data).hexdigest()
+
+    def claim(self, md5, out_path):
+        """
+        在下载线程中调用，内容第一次出现时登记out_path并返回None，否则返回已有图像的路径
+        之前的下载记录中的图像可能已被删除，需要检查文件是否存在
+        """
+        with self.lock:
+            path = self.md5_paths.get(md5, None)
+            if path is not None and (md5 in self.claimed or os.path.exists(path)):
+                return path
+            self.md5_paths[md5] = out_path
+            self.claimed.add(md5)
+            return None
+
+    def release(self, md5, out_path):
+        """
+        登记的图像写入失败时调用，之后相同内容的图像可以重新登记
+        """
+        with self.lock:
+            if self.md5_paths.get(md5, None) == out_path:
+                self.md5_paths.pop(md5)
+                self.claimed.discard(md5)
+
+    def add(self, record):
+        """
+        在主线程中调用，追加一条记录
+        """
+        self.records[record["url"]] = record
+        self.fs.write("{}\n".format(json.dumps(record, ensure_ascii=False)))
+        self.n_unflushed += 1
+        if self.n_unflushed >= self.flush_interval:
+            self.fs.flush()
+            self.n_unflushed = 0
+
+    def close(self):
+        self.fs.flush()
+        self.fs.close()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+流式下载器: 线程池 + 每个线程一个keep-alive的Session，限制同时下载的数量，直接写入原始bytes
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from PIL import Image
+
+p = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if p not in sys.path:
+    sys.path.append(p)
+
+from myutils.project_utils import *
+
+
+class UrlDownloader(object):
+    """
+    下载url列表，任务为(url, 输出路径)，结果通过callback返回
+    """
+    def __init__(self, n_threads=32, max_in_flight=256, timeout=5, n_retry=2, backoff=0.5, log_interval=1000):
+        """
+        :param backoff: 5xx或超时后重试前等待的秒数，每次重试翻倍
+        """
+        self.n_threads = n_threads
+        self.max_in_flight = max(max_in_flight, n_threads)
+        self.timeout = timeout
+        self.n_retry = n_retry
+        self.backoff = backoff
+        self.log_interval = log_interval
+        self.local = threading.local()
+        self.made_dirs = set()
+        self.dir_lock = threading.Lock()
+
+    def get_session(self):
+        """
+        每个线程一个Session，复用连接
+        """
+        session = getattr(self.local, "session", None)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from requests.packages.urllib3.exceptions import InsecureRequestWarning
+            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.verify = False
+            self.local.session = session
+        return session
+
+    def fetch(self, url):
+        """
+        下载url，返回原始bytes，失败返回None
+        """
+        for i in range(self.n_retry + 1):
+            if i > 0:
+                time.sleep(self.backoff * 2 ** (i - 1))
+            try:
+                response = self.get_session().get(url, timeout=self.timeout)
+                if response.status_code == 200 and response.content:
+                    return response.content
+                if response.status_code < 500:
+                    return None  # 4xx不重试
+            except Exception as e:
+                if i == self.n_retry:
+                    print('[Warning] 下载失败: {}, {}'.format(url, e))
+        return None
+
+    @staticmethod
+    def is_image(data):
+        """
+        检查是否为完整的图像，过滤html页面、CDN错误页和截断的文件，只解码不重新编码
+        截断的图像在load时报错(ImageFile.LOAD_TRUNCATED_IMAGES为False)，文件末尾的附加数据(如实况照片)不影响
+        """
+        try:
+            img = Image.open(io.BytesIO(data))
+            if img.format == "JPEG":
+                img.draft(img.mode, (max(img.width // 8, 1), max(img.height // 8, 1)))  # 1/8缩放解码，仍读取全部数据
+            img.load()
+        except Exception:
+            return False
+        return True
+
+    def make_dir(self, out_path):
+        out_dir = os.path.dirname(out_path)
+        if out_dir in self.made_dirs:
+            return
+        with self.dir_lock:
+            os.makedirs(out_dir, exist_ok=True)
+            self.made_dirs.add(out_dir)
+
+    def write_file(self, data, out_path):
+        self.make_dir(out_path)
+        with open(out_path, 'wb') as f:
+            f.write(data)
+
+    def download_one(self, url, out_path, manifest=None):
+        """
+        下载并保存，不解码不重新编码，返回下载记录
+        有manifest时按内容去重，相同的图像只保存一次
+        不是图像或保存失败时status为fail，异常不会中断整个下载
+        """
+        record = {"url": url, "status": "fail", "md5": "", "size": 0, "path": out_path}
+        try:
+            data = self.fetch(url)
+            if data is None:
+                return record
+            if not self.is_image(data):
+                print('[Warning] 不是完整的图像: {}, {} bytes'.format(url, len(data)))
+                return record
+            record["size"] = len(data)
+            if manifest is not None:
+                record["md5"] = manifest.get_md5(data)
+                exist_path = manifest.claim(record["md5"], out_path)
+                if exist_path is not None:
+                    record["status"] = "dup"
+                    record["path"] = exist_path
+                    return record
+            try:
+                self.write_file(data, out_path)
+            except Exception:
+                if manifest is not None:
+                    manifest.release(record["md5"], out_path)
+                raise
+            record["status"] = "ok"
+        except Exception as e:
+            print('[Warning] 处理失败: {}, {}'.format(url, e))
+            record["status"] = "fail"
+        return record
+
+    def download(self, tasks, callback=None, manifest=None):
+        """
+        流式下载，同时最多max_in_flight个任务，tasks可以是生成器
+        :param tasks: [(url, 输出路径), ...]
+        :param callback: 每个任务完成后在主线程中调用，参数为下载记录
+        :param manifest: DownloadManifest，跳过已完成的url，并记录每个url的结果
+        :return: 统计信息
+        """
+        stat = {"n_ok": 0, "n_dup": 0, "n_skip": 0, "n_fail": 0, "n_bytes": 0}
+        s_time = time.time()
+
+        def handle(futures):
+            for future in futures:
+                record = future.result()
+                stat["n_{}".format(record["status"])] += 1
+                stat["n_bytes"] += record["size"]
+                if manifest is not None:
+                    manifest.add(record)
+                if callback is not None:
+                    callback(record)
+                n_done = stat["n_ok"] + stat["n_dup"] + stat["n_fail"]
+                if self.log_interval and n_done % self.log_interval == 0:
+                    self.print_stat(stat, time.time() - s_time)
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            in_flight = set()
+            for url, out_path in tasks:
+                if manifest is not None and manifest.is_done(url):
+                    stat["n_skip"] += 1
+                    continue
+                if len(in_flight) >= self.max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    handle(done)
+                in_flight.add(pool.submit(self.download_one, url, out_path, manifest))
+            handle(in_flight)
+        stat["elapsed"] = time.time() - s_time
+        self.print_stat(stat, stat["elapsed"])
+        return stat
+
+    @staticmethod
+    def print_stat(stat, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        print('[Info] 成功: {}, 重复: {}, 跳过: {}, 失败: {}, 速度: {:.1f} 张/s, {:.2f} MB/s'.format(
+            stat["n_ok"], stat["n_dup"], stat["n_skip"], stat["n_fail"],
+            (stat["n_ok"] + stat["n_dup"]) / elapsed, stat["n_bytes"] / elapsed / 1024 / 1024))
+
+
+class FolderHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持keep-alive
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_folder(folder, port=0):
+    """
+    本地HTTP服务，提供文件夹中的文件，用于替代图片服务器测试下载
+    :return: 服务和根url，使用完调用server.shutdown()
+    """
+    handler = partial(FolderHandler, directory=folder)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def check_downloader(img_folder, out_folder, n_threads=16):
+    """
+    通过本地HTTP服务下载文件夹中的图片，检查内容是否一致，以及断点续传、去重和非图像、截断图像的过滤
+    """
+    from preprocess.download_manifest import DownloadManifest
+    paths_list, names_list = traverse_dir_files(img_folder)
+    serve_dir = tempfile.mkdtemp()
+    shutil.copytree(img_folder, os.path.join(serve_dir, "img"))
+    with open(paths_list[0], 'rb') as f:
+        img_data = f.read()
+    # 返回200的错误页和截断的图像
+    bad_files = {"error.html": b"<html><body>404 Not Found</body></html>",
+                 "truncated.jpg": img_data[:len(img_data) // 2]}
+    # 末尾有附加数据的完整图像(如三星的SEFT、实况照片)，应正常下载
+    trailer_data = img_data + b"SEFH" + b"\x00" * 64 + b"SEFT"
+    for name, data in list(bad_files.items()) + [("trailer.jpg", trailer_data)]:
+        with open(os.path.join(serve_dir, name), 'wb') as f:
+            f.write(data)
+    server, base_url = serve_folder(serve_dir)
+    tasks = []
+    for path, name in zip(paths_list, names_list):
+        rel_path = os.path.relpath(path, img_folder)
+        tasks.append(("{}/img/{}".format(base_url, rel_path), os.path.join(out_folder, rel_path)))
+    for name in ["trailer.jpg", "not_exist.jpg"] + list(bad_files.keys()):
+        tasks.append(("{}/{}".format(base_url, name), os.path.join(out_folder, name)))
+    # 相同内容的不同url
+    tasks.append(("{}?dup=1".format(tasks[0][0]), os.path.join(out_folder, "dup.jpg")))
+    manifest_path = os.path.join(out_folder, "manifest.jsonl")
+    downloader = UrlDownloader(n_threads=n_threads, max_in_flight=n_threads * 2)
+    try:
+        manifest = DownloadManifest(manifest_path)
+        stat = downloader.download(tasks, manifest=manifest)
+        manifest.close()
+        manifest = DownloadManifest(manifest_path)
+        stat_2 = downloader.download(tasks, manifest=manifest)
+        manifest.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(serve_dir, ignore_errors=True)
+    # 每个url对应的图像(重复的图像对应已有的文件)与原图一致
+    for path, (url, _) in zip(paths_list, tasks):
+        with open(path, 'rb') as f1, open(manifest.records[url]["path"], 'rb') as f2:
+            assert f1.read() == f2.read(), url
+    with open(manifest.records["{}/trailer.jpg".format(base_url)]["path"], 'rb') as f:
+        assert f.read() == trailer_data
+    n_img, n_fail = len(paths_list) + 2, len(bad_files) + 1
+    assert stat["n_ok"] + stat["n_dup"] == n_img and stat["n_dup"] >= 1 and stat["n_fail"] == n_fail, stat
+    # 先完成的url写入文件，与顺序无关: 相同内容的url指向同一个文件，且只写入了一个文件
+    md5_paths = dict()
+    for url, out_path in tasks:
+        record = manifest.records[url]
+        if record["status"] == "fail":
+            continue
+        md5_paths.setdefault(record["md5"], set()).add(record["path"])
+        assert (record["status"] == "ok") == os.path.exists(out_path), record
+    assert all(len(paths) == 1 for paths in md5_paths.values()), md5_paths
+    assert manifest.records[tasks[0][0]]["path"] == manifest.records[tasks[-1][0]]["path"]
+    assert all(not os.path.exists(os.path.join(out_folder, name)) for name in bad_files)
+    assert stat_2["n_skip"] == n_img and stat_2["n_fail"] == n_fail, stat_2
+    print('[Info] 检查通过: {}'.format(out_folder))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='通过本地HTTP服务检查下载器')
+    parser.add_argument('-i', dest='img_folder', required=True, help='图片文件夹', type=str)
+    parser.add_argument('-o', dest='out_folder', required=True, help='输出文件夹', type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    check_downloader(args.img_folder, args.out_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+训练后int8量化，输出量化模型，并在验证文件夹上对比精度和耗时
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader, Subset
+
+from dataset import flowerDataset
+from model.model import MobileNetV3_large, MobileNetV3_small
+from model.quantization import quantize_model, save_quantized, load_quantized
+
+
+def build_loader(data_dir, batch_size, num=0):
+    transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+    ])
+    data = flowerDataset(data_dir=data_dir, transform=transform)
+    if 0 < num < len(data):
+        data = Subset(data, random.sample(range(len(data)), num))  # 随机采样校准图像
+    return DataLoader(dataset=data, batch_size=batch_size, shuffle=False)
+
+
+def evaluate(net, data_loader):
+    """
+    返回准确率和每张图像的平均耗时(毫秒)
+    """
+    correct, total, elapsed = 0, 0, 0.
+    with torch.no_grad():
+        for img, label in data_loader:
+            s_time = time.perf_counter()
+            out = net(img)
+            elapsed += time.perf_counter() - s_time
+            correct += (out.argmax(dim=1) == label).sum().item()
+            total += label.size(0)
+    return correct / max(total, 1), elapsed * 1000 / max(total, 1)
+
+
+def measure_latency(net, n_iter=50, n_warmup=5):
+    """
+    batch为1时的单次前向耗时中位数(毫秒)
+    """
+    x = torch.randn(1, 3, 224, 224)
+    times = []
+    with torch.no_grad():
+        for i in range(n_warmup + n_iter):
+            s_time = time.perf_counter()
+            net(x)
+            if i >= n_warmup:
+                times.append((time.perf_counter() - s_time) * 1000)
+    return float(np.median(times))
+
+
+def parse_args():
+    """
+    处理脚本参数
+    """
+    parser = argparse.ArgumentParser(description='训练后int8量化')
+    parser.add_argument('-m', dest='weight_path', required=True, help='fp32模型权重', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='类别数', type=int, default=2)
+    parser.add_argument('-c', dest='calib_dir', required=True, help='校准文件夹', type=str)
+    parser.add_argument('-v', dest='val_dir', required=False, help='验证文件夹, 用于对比精度和耗时', type=str)
+    parser.add_argument('-o', dest='out_path', required=True, help='量化模型输出路径', type=str)
+    parser.add_argument('--calib-num', dest='calib_num', required=False, help='校准图像数', type=int, default=512)
+    parser.add_argument('--batch-size', dest='batch_size', required=False, help='batch大小', type=int, default=32)
+    args = parser.parse_args()
+    print('[Info] 参数: {}'.format(vars(args)))
+    return args
+
+
+def main():
+    args = parse_args()
+    random.seed(47)
+    net_cls = MobileNetV3_small if args.net_kind.lower() == 'small' else MobileNetV3_large
+    net = net_cls(num_classes=args.num_classes)
+    net.load_state_dict(torch.load(args.weight_path, map_location='cpu'))
+    net.eval()
+
+    calib_loader = build_loader(args.calib_dir, args.batch_size, num=args.calib_num)
+    n_batch = len(calib_loader)
+    print('[Info] 校准图像数: {}, batch数: {}'.format(len(calib_loader.dataset), n_batch))
+    q_net = quantize_model(net, calib_loader, n_batch=n_batch)
+    save_quantized(q_net, args.out_path)
+
+    if not args.val_dir:
+        return
+    q_net = load_quantized(args.out_path)  # 评估实际部署的文件
+    val_loader = build_loader(args.val_dir, args.batch_size)
+    fp_acc, fp_ms = evaluate(net, val_loader)
+    q_acc, q_ms = evaluate(q_net, val_loader)
+    fp_lat, q_lat = measure_latency(net), measure_latency(q_net)
+    print("[Info] " + "-" * 50)
+    print('[Info] 验证图像数: {}'.format(len(val_loader.dataset)))
+    print('[Info] fp32: 准确率 {:.4f}, 批量 {:.2f} ms/张, batch=1 {:.2f} ms'.format(fp_acc, fp_ms, fp_lat))
+    print('[Info] int8: 准确率 {:.4f}, 批量 {:.2f} ms/张, batch=1 {:.2f} ms'.format(q_acc, q_ms, q_lat))
+    print('[Info] 准确率变化: {:+.4f}, 批量加速: {:.2f}x, batch=1加速: {:.2f}x'.format(
+        q_acc - fp_acc, fp_ms / max(q_ms, 1e-6), fp_lat / max(q_lat, 1e-6)))
+    print("[Info] " + "-" * 50)
+
+
+if __name__ == '__main__':
+    main()
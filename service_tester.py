@@ -6,21 +6,107 @@ Created by C. L. Wang on 31.8.21
 """
 
 import argparse
+import io
+import queue
+import threading
 from multiprocessing.pool import Pool
 
+from evaluation import ClassificationMetrics
 from myutils.cv_utils import *
 from myutils.make_html_page import make_html_page
 from myutils.project_utils import *
-from x_utils.vpf_sevices import get_vpf_service_np
+from myutils.service_client import get_local_service_np
+
+DEFAULT_LABEL_NAMES = ["纸质文档", "非纸质文档"]
+
+
+class ResultSink(object):
+    """
+    汇总测试结果，统计混淆矩阵等指标，错误样本由一个线程批量写入文件
+    """
+    def __init__(self, out_file, num_classes=2, batch_size=1000, flush_interval=1.0):
+        self.out_file = out_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=100000)
+        self.n_total = 0
+        self.n_error = 0  # 服务调用失败，不计入正确率
+        self.mismatches = []  # [(img_url, r_label, p_label), ...]，只保存错误样本
+        self.metrics = ClassificationMetrics(num_classes)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, img_url, r_label, p_label, prob=None):
+        """
+        p_label为None表示服务调用失败，prob为各类别的概率，可选
+        """
+        if p_label is None:
+            self.n_total += 1
+            self.n_error += 1
+            return
+        self.put_many([img_url], [r_label], [p_label], None if prob is None else [prob])
+
+    def put_many(self, img_urls, r_labels, p_labels, probs=None):
+        """
+        批量添加预测结果，指标向量化累加，只逐个处理错误样本
+        """
+        r_labels = np.asarray(r_labels, dtype=np.int64)
+        p_labels = np.asarray(p_labels, dtype=np.int64)
+        self.metrics.update(r_labels, p_labels, probs)
+        self.n_total += len(r_labels)
+        wrong_idxes = np.flatnonzero(r_labels != p_labels)
+        for idx in wrong_idxes:
+            img_url, r_label, p_label = img_urls[idx], int(r_labels[idx]), int(p_labels[idx])
+            self.mismatches.append((img_url, r_label, p_label))
+            self.queue.put("{}\t{}\t{}".format(img_url, r_label, p_label))
+
+    def run(self):
+        lines = []
+        last_flush = time.time()
+        with io.open(self.out_file, "a+", encoding='utf8') as fs:
+            while True:
+                try:
+                    line = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    line = ""
+                if line is not None and line:
+                    lines.append(line)
+                if lines and (line is None or len(lines) >= self.batch_size
+                              or time.time() - last_flush >= self.flush_interval):
+                    fs.write("\n".join(lines) + "\n")
+                    fs.flush()
+                    lines = []
+                    last_flush = time.time()
+                if line is None:
+                    break
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def accuracy(self):
+        """
+        调用成功的样本的正确率，与metrics相同，调用失败单独统计
+        """
+        return self.metrics.accuracy()
 
 
 class ServiceTester(object):
-    def __init__(self, in_folder, service, out_folder):
+    # detector不为空时，使用本地模型(inference.Detector)批量评估，不调用服务
+    # label_names为各类别的名称，为空时2分类使用默认名称，其他类别数使用类别id
+    def __init__(self, in_folder, service, out_folder, detector=None, num_classes=2, label_names=None):
         self.in_folder = in_folder
+        self.num_classes = num_classes
+        if not label_names and num_classes == len(DEFAULT_LABEL_NAMES):
+            label_names = DEFAULT_LABEL_NAMES
+        if label_names and len(label_names) != num_classes:
+            raise ValueError("类别名称数{}与类别数{}不一致".format(len(label_names), num_classes))
+        self.label_names = label_names
         self.out_folder = out_folder
         self.service = service
+        self.detector = detector
         print('[Info] 输入文件夹: {}'.format(self.in_folder))
-        print('[Info] 服务: {}'.format(self.service))
+        print('[Info] 服务: {}'.format(self.service if detector is None else "本地模型"))
         print('[Info] 输出文件夹: {}'.format(self.out_folder))
 
     @staticmethod
@@ -35,49 +121,140 @@ class ServiceTester(object):
         return img_url
 
     @staticmethod
-    def process_img_path(img_idx, img_path, service,  out_file):
-        img_bgr = cv2.imread(img_path)
-        res_dict = get_vpf_service_np(img_np=img_bgr, service_name=service)  # 表格
-        p_label = res_dict["data"]["label"]
-        p_label = int(p_label)
+    def call_service(img_bgr, service):
+        """
+        调用服务，service为http地址时调用本地推理服务(inference_server.py)
+        """
+        if service.startswith("http"):
+            return get_local_service_np(img_bgr, service)
+        from x_utils.vpf_sevices import get_vpf_service_np
+        return get_vpf_service_np(img_np=img_bgr, service_name=service)  # 表格
+
+    @staticmethod
+    def process_img_path(img_idx, img_path, service):
+        """
+        在子进程中运行，返回(img_idx, 错误样本的url, 真实标签, 预测标签, 概率)，调用失败时预测标签为None
+        """
         r_label = int(img_path.split("/")[-2])
+        img_bgr = cv2.imread(img_path)
+        try:
+            res_dict = ServiceTester.call_service(img_bgr, service)
+            p_label = int(res_dict["data"]["label"])
+            prob = res_dict["data"].get("prob", None)  # 本地推理服务返回概率
+        except Exception as e:
+            print('[Warning] 服务调用失败: {}, {}'.format(img_path, e))
+            return img_idx, img_path, r_label, None, None
 
+        img_url = ""
         if p_label != r_label:
             img_name = "{}-{}.jpg".format(get_current_time_str(), time.time())
-            img_url = ServiceTester.save_img_path(img_bgr, img_name)
-            write_line(out_file, "{}\t{}\t{}".format(img_url, r_label, p_label))
-        print('[Info] 处理完成: {}, right: {}'.format(img_idx, p_label == r_label))
+            try:
+                img_url = ServiceTester.save_img_path(img_bgr, img_name)
+            except Exception as e:
+                print('[Warning] 上传失败, 使用本地路径: {}, {}'.format(img_path, e))
+                img_url = img_path
+        return img_idx, img_url, r_label, p_label, prob
+
+    @staticmethod
+    def process_img_task(task):
+        img_idx, img_path, service = task
+        return ServiceTester.process_img_path(img_idx, img_path, service)
 
     def process_folder(self):
         paths_list, names_list = traverse_dir_files(self.in_folder)
         time_str = get_current_time_str()
         out_file = os.path.join(self.out_folder, "val_{}.txt".format(time_str))
         out_html = os.path.join(self.out_folder, "val_{}.html".format(time_str))
+        sink = ResultSink(out_file, num_classes=self.num_classes)
+        if self.detector is not None:
+            self.process_folder_local(paths_list, sink)
+            sink.close()
+            self.make_report(sink, out_file, out_html, self.label_names)
+            return
+        tasks = ((img_idx, img_path, self.service) for img_idx, img_path in enumerate(paths_list))
         pool = Pool(processes=100)
-        for img_idx, img_path in enumerate(paths_list):
-            pool.apply_async(ServiceTester.process_img_path, (img_idx, img_path, self.service, out_file))
+        for img_idx, img_url, r_label, p_label, prob in pool.imap_unordered(ServiceTester.process_img_task, tasks,
+                                                                            chunksize=4):
+            sink.put(img_url, r_label, p_label, prob)
+            if sink.n_total % 1000 == 0:
+                print('[Info] 处理完成: {}, 正确率: {}'.format(sink.n_total, sink.accuracy()))
         pool.close()
         pool.join()
+        sink.close()
+        self.make_report(sink, out_file, out_html, self.label_names)
+
+    def predict_one(self, img_path):
+        try:
+            return self.detector.predict(img_path)
+        except Exception as e:
+            print('[Warning] 预测失败: {}, {}'.format(img_path, e))
+            return None
+
+    def process_folder_local(self, paths_list, sink, chunk_size=1024):
+        """
+        本地模型评估，多线程解码，批量前向，错误样本保存本地路径
+        """
+        s_time = time.time()
+        for idx in range(0, len(paths_list), chunk_size):
+            chunk_paths = paths_list[idx:idx + chunk_size]
+            try:
+                # 无法读取的图片结果为None，不影响同一批的其他图片
+                res_list = self.detector.predict_batch(chunk_paths, skip_errors=True)
+            except Exception as e:
+                print('[Warning] 批量预测失败, 逐张预测: {}'.format(e))
+                res_list = [self.predict_one(img_path) for img_path in chunk_paths]
+            ok_paths, r_labels, p_labels, probs = [], [], [], []
+            for img_path, res_dict in zip(chunk_paths, res_list):
+                r_label = int(img_path.split("/")[-2])
+                if not res_dict:
+                    sink.put(img_path, r_label, None)
+                    continue
+                ok_paths.append(img_path)
+                r_labels.append(r_label)
+                p_labels.append(res_dict["label"])
+                probs.append(res_dict["prob"])
+            sink.put_many(ok_paths, r_labels, p_labels, probs)
+            elapsed = time.time() - s_time
+            print('[Info] 处理完成: {}, 正确率: {}, 速度: {:.1f} 张/s'.format(
+                sink.n_total, sink.accuracy(), safe_div(sink.n_total, elapsed)))
+
+    @staticmethod
+    def make_report(sink, out_file, out_html, label_names=None):
+        """
+        正确率只统计调用成功的样本(metrics)，调用失败的数量单独输出
+        """
         print('[Info] 处理完成: {}'.format(out_file))
-        data_lines = read_file(out_file)
-        print('[Info] 正确率: {}'.format(safe_div(len(paths_list) - len(data_lines), len(paths_list))))
+        print('[Info] 样本数: {}, 调用成功: {}, 调用失败: {}'.format(
+            sink.n_total, sink.n_total - sink.n_error, sink.n_error))
+        sink.metrics.print_report(label_names)
+        summary = sink.metrics.summary(label_names)
+        summary["n_error"] = sink.n_error
+        save_dict_to_json(out_file.replace(".txt", "_metrics.json"), summary)
         out_list = []
-        label_str_list = ["纸质文档", "非纸质文档"]
-        for data_line in data_lines:
-            img_url, r_label, p_label = data_line.split("\t")
-            out_list.append([img_url, label_str_list[int(r_label)], label_str_list[int(p_label)]])
+        for img_url, r_label, p_label in sink.mismatches:
+            out_list.append([img_url, ClassificationMetrics.get_name(r_label, label_names),
+                             ClassificationMetrics.get_name(p_label, label_names)])
         make_html_page(out_html, out_list)
         print('[Info] 处理完成: {}'.format(out_html))
 
-
 def parse_args():
     """
     处理脚本参数，支持相对路径
     """
     parser = argparse.ArgumentParser(description='服务测试')
     parser.add_argument('-i', dest='in_folder', required=False, help='测试文件夹', type=str)
-    parser.add_argument('-s', dest='service', required=False, help='服务', type=str)
+    parser.add_argument('-s', dest='service', required=False, help='服务, 或本地推理服务地址, 如http://127.0.0.1:8866/predict', type=str)
     parser.add_argument('-o', dest='out_folder', required=False, help='输出文件夹', type=str)
+    # 指定模型权重时，使用本地模型评估，不调用服务
+    parser.add_argument('-m', dest='weight_path', required=False, help='本地模型权重', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='本地模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='类别数', type=int, default=2)
+    parser.add_argument('-l', dest='label_names', required=False, help='各类别的名称, 按类别id排序', nargs='+',
+                        default=None)
+    parser.add_argument('-r', dest='backend', required=False, help='本地模型运行时, eager/torchscript/onnxruntime',
+                        type=str, default='eager')
+    parser.add_argument('-b', dest='batch_size', required=False, help='本地模型batch大小', type=int, default=64)
+    parser.add_argument('-t', dest='num_workers', required=False, help='本地模型解码线程数', type=int, default=8)
 
     args = parser.parse_args()
 
@@ -91,12 +268,19 @@ def parse_args():
     print("输出文件夹: {}".format(arg_out_folder))
     mkdir_if_not_exist(arg_out_folder)
 
-    return arg_in_folder, arg_service, arg_out_folder
+    return args
 
 
 def main():
-    arg_in_folder, arg_service, arg_out_folder = parse_args()
-    st = ServiceTester(arg_in_folder, arg_service, arg_out_folder)
+    args = parse_args()
+    detector = None
+    if args.weight_path:
+        from inference import Detector
+        print("本地模型: {}".format(args.weight_path))
+        detector = Detector(args.net_kind, num_classes=args.num_classes, weight_path=args.weight_path,
+                            max_batch_size=args.batch_size, num_workers=args.num_workers, backend=args.backend)
+    st = ServiceTester(args.in_folder, args.service, args.out_folder, detector=detector, num_classes=args.num_classes,
+                       label_names=args.label_names)
     st.process_folder()
 
 
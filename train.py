@@ -1,105 +1,265 @@
-import sys
-sys.path.append('./data')
-sys.path.append('./model')
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
 
+训练，参数来自命令行或json配置文件，支持从断点恢复
+python train.py -d data/splitData -n 2 -k large -o weights
+python train.py -c weights/config.json --resume
+"""
+
+import argparse
+import json
 import os
+import random
+import time
+
+import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
-import torchvision.transforms as transforms
 import torch.optim as optim
-from dataset import flowerDataset
-from model.model import MobileNetV3_large
-from torch.autograd import Variable
-
-#宏定义一些数据，如epoch数，batchsize等
-MAX_EPOCH=1000
-BATCH_SIZE=64
-LR=0.0001
-log_interval=3
-val_interval=1
-num_of_class = 3
-
-# ============================ step 1/5 数据 ============================
-split_dir = "/ProjectRoot/workspace/handwrite_remove/mydata/regions_clz_data_mini"
-print('[Info] 文件夹地址: {}'.format(split_dir))
-train_dir=os.path.join(split_dir, "train")
-valid_dir=os.path.join(split_dir, "val")
-
-#对训练集所需要做的预处理
-train_transform=transforms.Compose([
-    transforms.Resize((224,224)),
-    transforms.ToTensor(),
-])
-
-#对验证集所需要做的预处理
-valid_transform=transforms.Compose([
-    transforms.Resize((224,224)),
-    transforms.ToTensor(),
-])
-
-# 构建MyDataset实例
-train_data=flowerDataset(data_dir=train_dir,transform=train_transform)
-valid_data=flowerDataset(data_dir=valid_dir,transform=valid_transform)
-
-# 构建DataLoader
-# 训练集数据最好打乱
-# DataLoader的实质就是把数据集加上一个索引号，再返回
-train_loader=DataLoader(dataset=train_data,batch_size=BATCH_SIZE,shuffle=True)
-valid_loader=DataLoader(dataset=valid_data,batch_size=BATCH_SIZE)
-
-# ============================ step 2/5 模型 ============================
-net=MobileNetV3_large(num_classes=num_of_class)
-if torch.cuda.is_available():
-    net.cuda()
-# ============================ step 3/5 损失函数 ============================
-criterion=nn.CrossEntropyLoss()
-# ============================ step 4/5 优化器 ============================
-optimizer=optim.Adam(net.parameters(),lr=LR, betas=(0.9, 0.99))# 选择优化器
-# ============================ step 5/5 训练 ============================
-# 记录每一次的数据，方便绘图
-train_curve=list()
-valid_curve=list()
-net.train()
-accurancy_global=0.0
-for epoch in range(MAX_EPOCH):
-    loss_mean=0.
-    correct=0.
-    total=0.
-    running_loss = 0.0
-
-    for i,data in enumerate(train_loader):
-        img,label=data
-        img = Variable(img)
-        label = Variable(label)
-        if torch.cuda.is_available():
-            img=img.cuda()
-            label=label.cuda()
-        # 前向传播
-        out=net(img)
-        optimizer.zero_grad()  # 归0梯度
-        loss=criterion(out,label)#得到损失函数
-
-        print_loss=loss.data.item()
-
-        loss.backward()#反向传播
-        optimizer.step()#优化
-        if (i+1)%log_interval==0:
-            print('epoch:{},loss:{:.4f}'.format(epoch+1,loss.data.item()))
-        _, predicted = torch.max(out.data, 1)
-        total += label.size(0)
-        # print("============================================")
-        # print("源数据标签：",label)
-        # print("============================================")
-        # print("预测结果：",predicted)
-        # print("相等的结果为：",predicted == label)
-        correct += (predicted == label).sum()
-    print("============================================")
-    accurancy = float(correct) / float(total)
-    if accurancy>accurancy_global:
-        torch.save(net.state_dict(), './weights/best.pkl')
-        print("准确率由：", accurancy_global, "上升至：", accurancy, "已更新并保存权值为weights/best.pkl")
-        accurancy_global=accurancy
-    print('第%d个epoch的识别准确率为：%d%%, correct: %d, total: %d' % (epoch + 1, 100*accurancy, correct, total))
-torch.save(net.state_dict(), './weights/last.pkl')
-print("训练完毕，权重已保存为：weights/last.pkl")
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader
+
+from dataset import flowerDataset, flowerPackedDataset, ClassBalancedSampler, EpochRandomSampler, get_labels, \
+    get_loader_kwargs, autotune_num_workers, channels_last_collate
+from evaluation import ClassificationMetrics
+from model.checkpoint import CheckpointWriter, load_checkpoint
+from model.model import MobileNetV3_large, MobileNetV3_small
+from model.precision import autocast, get_grad_scaler, get_precision
+
+CKPT_NAME = "checkpoint.pth"
+
+
+class Trainer(object):
+    def __init__(self, args):
+        self.args = args
+        self.num_classes = args.num_classes
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # channels_last时模型和输入都使用NHWC布局
+        self.memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+        os.makedirs(args.out_dir, exist_ok=True)
+        self.set_seed(args.seed)
+        self.train_loader, self.valid_loader, self.train_sampler = self.build_data()
+        self.net = self.build_model()
+        self.criterion = nn.CrossEntropyLoss()
+        self.optimizer = optim.Adam(self.net.parameters(), lr=args.lr, betas=(0.9, 0.99))
+        # 混合精度，CPU上为bf16，GPU上fp16需要缩放loss
+        self.precision = get_precision(args.precision, self.device)
+        self.scaler = get_grad_scaler(self.precision, self.device)
+        self.writer = CheckpointWriter()
+        self.start_epoch = 0  # 已完成的epoch数
+        self.best_metric = 0.0  # 验证集准确率
+        self.train_curve = list()
+        self.valid_curve = list()
+        ckpt_path = os.path.join(args.out_dir, CKPT_NAME)
+        if args.resume and os.path.isfile(ckpt_path):
+            self.resume(ckpt_path)
+        elif args.resume:
+            print('[Warning] 没有断点, 从头训练: {}'.format(ckpt_path))
+
+    @staticmethod
+    def set_seed(seed):
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+
+    def build_data(self):
+        """
+        数据，pack_dir不为空时读取dataset.py打包的数据集
+        """
+        args = self.args
+        print('[Info] 文件夹地址: {}'.format(args.pack_dir or args.data_dir))
+        if args.pack_dir:
+            # 打包的图片已经缩放过，只需要转换成Tensor
+            train_data = flowerPackedDataset(os.path.join(args.pack_dir, "train"), transform=transforms.ToTensor())
+            valid_data = flowerPackedDataset(os.path.join(args.pack_dir, "val"), transform=transforms.ToTensor())
+        else:
+            transform = transforms.Compose([
+                transforms.Resize((args.img_size, args.img_size)),
+                transforms.ToTensor(),
+            ])
+            train_data = flowerDataset(data_dir=os.path.join(args.data_dir, "train"), transform=transform)
+            valid_data = flowerDataset(data_dir=os.path.join(args.data_dir, "val"), transform=transform)
+        # 采样顺序只由seed和epoch决定，与DataLoader的迭代器是否复用(persistent_workers)无关，断点恢复后与不中断时相同
+        if args.samples_per_class > 0:
+            # 每个epoch每个类别采样samples_per_class个训练样本(类别均衡)，替代复制样本的方式
+            train_sampler = ClassBalancedSampler(get_labels(train_data), num_per_class=args.samples_per_class,
+                                                 seed=args.seed)
+        else:
+            train_sampler = EpochRandomSampler(train_data, seed=args.seed)
+        num_workers = args.num_workers
+        if num_workers < 0:
+            num_workers = autotune_num_workers(train_data, args.batch_size, prefetch_factor=args.prefetch_factor)
+        loader_kwargs = get_loader_kwargs(num_workers, prefetch_factor=args.prefetch_factor)
+        if args.channels_last:
+            loader_kwargs["collate_fn"] = channels_last_collate
+        # worker的种子从loader自己的generator中获取，不消耗全局随机数，全局随机数状态保存在断点中
+        train_loader = DataLoader(dataset=train_data, batch_size=args.batch_size, sampler=train_sampler,
+                                  generator=torch.Generator().manual_seed(args.seed), **loader_kwargs)
+        valid_loader = DataLoader(dataset=valid_data, batch_size=args.batch_size,
+                                  generator=torch.Generator().manual_seed(args.seed), **loader_kwargs)
+        print('[Info] 训练集: {}, 验证集: {}'.format(len(train_data), len(valid_data)))
+        print('[Info] DataLoader: num_workers: {}, prefetch_factor: {}, pin_memory: {}, persistent_workers: {}'.format(
+            num_workers, loader_kwargs.get("prefetch_factor"), loader_kwargs["pin_memory"],
+            loader_kwargs.get("persistent_workers", False)))
+        return train_loader, valid_loader, train_sampler
+
+    def build_model(self):
+        if self.args.net_kind == "small":
+            net = MobileNetV3_small(num_classes=self.num_classes)
+        else:
+            net = MobileNetV3_large(num_classes=self.num_classes)
+        return net.to(self.device, memory_format=self.memory_format)
+
+    def resume(self, ckpt_path):
+        ckpt = load_checkpoint(ckpt_path, self.net, self.optimizer)
+        self.start_epoch = ckpt["epoch"]
+        self.best_metric = ckpt["best_metric"]
+        if ckpt.get("scaler"):
+            self.scaler.load_state_dict(ckpt["scaler"])
+        self.train_curve = ckpt.get("train_curve", [])
+        self.valid_curve = ckpt.get("valid_curve", [])
+
+    def train_epoch(self, epoch):
+        """
+        训练一个epoch，loss和正确数在device上累加，最后同步一次
+        """
+        self.net.train()
+        self.train_sampler.set_epoch(epoch)
+        loss_sum = torch.zeros((), device=self.device)
+        correct = torch.zeros((), dtype=torch.int64, device=self.device)
+        total = 0
+        for i, (img, label) in enumerate(self.train_loader):
+            img = img.to(self.device, memory_format=self.memory_format, non_blocking=True)
+            label = label.to(self.device, non_blocking=True)
+            with autocast(self.precision, self.device):
+                out = self.net(img)
+                loss = self.criterion(out, label)
+            self.optimizer.zero_grad(set_to_none=True)
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+            loss_sum += loss.detach() * label.size(0)
+            correct += (out.detach().argmax(dim=1) == label).sum()
+            total += label.size(0)
+            if (i + 1) % self.args.log_interval == 0:
+                # 打印时会同步GPU
+                print('[Info] epoch: {}, step: {}, loss: {:.4f}'.format(epoch + 1, i + 1, loss.item()))
+        total = max(total, 1)
+        return correct.item() / total, loss_sum.item() / total
+
+    def validate(self):
+        """
+        验证，loss和混淆矩阵都在device上累加，最后同步一次
+        :return: 准确率, 平均loss, 混淆矩阵(numpy)
+        """
+        k = self.num_classes
+        self.net.eval()
+        loss_sum = torch.zeros((), device=self.device)
+        confusion = torch.zeros(k * k, dtype=torch.int64, device=self.device)
+        with torch.inference_mode(), autocast(self.precision, self.device):
+            for img, label in self.valid_loader:
+                img = img.to(self.device, memory_format=self.memory_format, non_blocking=True)
+                label = label.to(self.device, non_blocking=True)
+                out = self.net(img)
+                loss_sum += self.criterion(out, label).float() * label.size(0)
+                confusion += torch.bincount(label * k + out.argmax(dim=1), minlength=k * k)
+        confusion = confusion.view(k, k).cpu().numpy()
+        total = max(int(confusion.sum()), 1)
+        return float(confusion.trace()) / total, loss_sum.item() / total, confusion
+
+    def save(self, epoch):
+        """
+        异步保存断点和最新的权重
+        """
+        out_dir = self.args.out_dir
+        self.writer.save_checkpoint(os.path.join(out_dir, CKPT_NAME), self.net, self.optimizer, epoch + 1,
+                                    self.best_metric, train_curve=self.train_curve, valid_curve=self.valid_curve,
+                                    scaler=self.scaler.state_dict(), config=vars(self.args))
+        self.writer.save(self.net.state_dict(), os.path.join(out_dir, "last.pkl"))
+
+    def train(self):
+        args = self.args
+        print('[Info] 开始训练, epoch: {} -> {}'.format(self.start_epoch + 1, args.max_epoch))
+        for epoch in range(self.start_epoch, args.max_epoch):
+            s_time = time.time()
+            accuracy, train_loss = self.train_epoch(epoch)
+            self.train_curve.append(train_loss)
+            print('[Info] epoch: {}, 训练准确率: {:.4f}, loss: {:.4f}, 耗时: {:.1f}s'.format(
+                epoch + 1, accuracy, train_loss, time.time() - s_time))
+            is_last = epoch + 1 == args.max_epoch
+            if (epoch + 1) % args.val_interval == 0 or is_last:
+                val_accuracy, val_loss, confusion = self.validate()
+                self.valid_curve.append(val_loss)
+                print('[Info] epoch: {}, 验证准确率: {:.4f}, loss: {:.4f}'.format(epoch + 1, val_accuracy, val_loss))
+                metrics = ClassificationMetrics(self.num_classes)
+                metrics.update_confusion(confusion)
+                metrics.print_report()
+                if val_accuracy > self.best_metric:
+                    print('[Info] 验证准确率由 {:.4f} 上升至 {:.4f}, 保存best.pkl'.format(self.best_metric, val_accuracy))
+                    self.best_metric = val_accuracy
+                    self.writer.save(self.net.state_dict(), os.path.join(args.out_dir, "best.pkl"))
+            if (epoch + 1) % args.save_interval == 0 or is_last:
+                self.save(epoch)
+        self.writer.close()
+        print('[Info] 训练完毕, 最优验证准确率: {:.4f}, 权重: {}'.format(self.best_metric, args.out_dir))
+
+
+def parse_args():
+    """
+    处理脚本参数，优先级: 命令行 > 配置文件 > 默认值
+    """
+    parser = argparse.ArgumentParser(description='训练')
+    parser.add_argument('-c', dest='config', required=False, help='json配置文件, 键与参数的dest相同', type=str, default='')
+    parser.add_argument('-d', dest='data_dir', required=False, help='数据集文件夹, 包含train和val', type=str,
+                        default='data/splitData')
+    parser.add_argument('-p', dest='pack_dir', required=False, help='dataset.py打包的数据集, 包含train和val', type=str,
+                        default='')
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=False, help='类别数', type=int, default=3)
+    parser.add_argument('-e', dest='max_epoch', required=False, help='epoch数', type=int, default=1000)
+    parser.add_argument('-b', dest='batch_size', required=False, help='batch大小', type=int, default=64)
+    parser.add_argument('-w', dest='num_workers', required=False, help='DataLoader进程数, -1时自动选择', type=int,
+                        default=4)
+    parser.add_argument('--prefetch-factor', dest='prefetch_factor', required=False, help='每个进程预读的batch数',
+                        type=int, default=2)
+    parser.add_argument('--lr', dest='lr', required=False, help='学习率', type=float, default=0.0001)
+    parser.add_argument('--precision', dest='precision', required=False,
+                        help='fp32/bf16/fp16, 低精度时使用autocast, CPU上为bf16', type=str, default='fp32')
+    parser.add_argument('--channels-last', dest='channels_last', action='store_true', help='使用NHWC内存布局')
+    parser.add_argument('--img-size', dest='img_size', required=False, help='图片尺寸', type=int, default=224)
+    parser.add_argument('--samples-per-class', dest='samples_per_class', required=False,
+                        help='大于0时每个epoch每个类别采样的样本数', type=int, default=0)
+    parser.add_argument('--log-interval', dest='log_interval', required=False, help='打印loss的step间隔', type=int,
+                        default=50)
+    parser.add_argument('--val-interval', dest='val_interval', required=False, help='验证的epoch间隔', type=int,
+                        default=1)
+    parser.add_argument('--save-interval', dest='save_interval', required=False, help='保存断点的epoch间隔', type=int,
+                        default=1)
+    parser.add_argument('--seed', dest='seed', required=False, help='随机种子', type=int, default=47)
+    parser.add_argument('-o', dest='out_dir', required=False, help='输出文件夹', type=str, default='weights')
+    parser.add_argument('--resume', dest='resume', action='store_true', help='从输出文件夹中的断点恢复')
+    args = parser.parse_args()
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config.pop("config", None)
+        config.pop("resume", None)
+        parser.set_defaults(**config)
+        args = parser.parse_args()
+    print('[Info] 参数: {}'.format(vars(args)))
+    return args
+
+
+def main():
+    args = parse_args()
+    trainer = Trainer(args)
+    with open(os.path.join(args.out_dir, "config.json"), 'w', encoding='utf-8') as f:
+        json.dump(vars(args), f, indent=2, ensure_ascii=False)
+    trainer.train()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -- coding: utf-8 --
+"""
+Copyright (c) 2026. All rights reserved.
+Created by C. L. Wang on 18.10.26
+
+冻结骨干网络，只训练分类头(conv3/conv4)
+骨干网络的池化特征只计算一次，缓存在内存映射文件中，类别变化时重新训练分类头只需要几秒
+python train_head.py -m weights/best.pkl -d data/splitData -n 6 -o weights/head.pkl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torchvision.transforms as transforms
+from torch.utils.data import DataLoader, Subset
+
+from dataset import flowerDataset, flowerPackedDataset, get_labels, get_loader_kwargs
+from evaluation import ClassificationMetrics
+from model.model import MobileNetV3_large, MobileNetV3_small
+
+HEAD_PREFIXES = ("conv3.", "conv4.")  # 分类头的参数
+
+
+def get_file_md5(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_sample_md5s(dataset, num_workers=8):
+    """
+    每个样本的内容md5，作为特征缓存的键，与路径和标签无关，修改类别、移动文件或重新划分数据集后仍可复用
+    文件夹数据集使用图片文件的md5，打包的数据集使用解码后的像素的md5
+    """
+    if hasattr(dataset, "data_info"):
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            return list(pool.map(get_file_md5, [path_img for path_img, _ in dataset.data_info]))
+    images = np.load(os.path.join(dataset.pack_dir, 'images.npy'), mmap_mode='r')
+    return [hashlib.md5(images[i].tobytes()).hexdigest() for i in range(len(images))]
+
+
+def build_net(net_kind, num_classes, weight_path):
+    """
+    创建模型并加载骨干网络的权重，权重的类别数可以不同，形状不同的分类头参数不加载
+    """
+    net = MobileNetV3_small(num_classes=num_classes) if net_kind == "small" else \
+        MobileNetV3_large(num_classes=num_classes)
+    state_dict = torch.load(weight_path, map_location='cpu')
+    net_state = net.state_dict()
+    skip_keys = [k for k, v in state_dict.items() if k in net_state and v.shape != net_state[k].shape]
+    for key in skip_keys:
+        state_dict.pop(key)
+    missing_keys, _ = net.load_state_dict(state_dict, strict=False)
+    missing_keys = [k for k in missing_keys if not k.startswith(HEAD_PREFIXES)]
+    if missing_keys:
+        raise ValueError("权重中缺少骨干网络的参数: {}".format(missing_keys))
+    if skip_keys:
+        print('[Info] 类别数不同, 不加载: {}'.format(skip_keys))
+    return net
+
+
+def get_dataset(data_dir, pack_dir, split, img_size=224):
+    if pack_dir:
+        return flowerPackedDataset(os.path.join(pack_dir, split), transform=transforms.ToTensor())
+    transform = transforms.Compose([
+        transforms.Resize((img_size, img_size)),
+        transforms.ToTensor(),
+    ])
+    return flowerDataset(data_dir=os.path.join(data_dir, split), transform=transform)
+
+
+def load_feature_cache(cache_dir, cache_key):
+    """
+    :return: 特征(只读的内存映射)和 md5 -> 行号，缓存不存在或cache_key不同时为空
+    """
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.isfile(meta_path):
+        return None, dict()
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if meta.get("key") != cache_key:
+        return None, dict()
+    feats = np.load(os.path.join(cache_dir, "features.npy"), mmap_mode='r')
+    return feats, {md5: idx for idx, md5 in enumerate(meta["md5s"])}
+
+
+def extract_features(net, dataset, cache_dir, cache_key, batch_size=64, num_workers=4):
+    """
+    获取数据集的骨干网络池化特征，按图片内容缓存在cache_dir中
+    输出: features.npy(M, C, float32)和meta.json(cache_key和每行图片的md5)
+    cache_key(模型和权重)相同时，已缓存的图片直接读取，只计算新的图片并追加到缓存中；标签每次从数据集中获取
+    :return: 特征(N, C)和标签
+    """
+    labels = np.array(get_labels(dataset), dtype=np.int64)
+    md5s = get_sample_md5s(dataset)
+    cached_feats, md5_rows = load_feature_cache(cache_dir, cache_key)
+    # 没有缓存的图片，内容相同的图片只计算一次
+    new_idxes = OrderedDict()
+    for idx, md5 in enumerate(md5s):
+        if md5 not in md5_rows and md5 not in new_idxes:
+            new_idxes[md5] = idx
+    print('[Info] 特征缓存: {}, 图片数: {}, 需要计算: {}'.format(cache_dir, len(md5s), len(new_idxes)))
+    if new_idxes:
+        new_feats = compute_features(net, Subset(dataset, list(new_idxes.values())), batch_size, num_workers)
+        cached_feats, md5_rows = save_feature_cache(cache_dir, cache_key, cached_feats, md5_rows, new_feats,
+                                                    list(new_idxes.keys()))
+    if not md5s:
+        return np.zeros((0, net.conv3.in_channels), dtype=np.float32), labels
+    feats = cached_feats[[md5_rows[md5] for md5 in md5s]]
+    return feats, labels
+
+
+def compute_features(net, dataset, batch_size=64, num_workers=4):
+    """
+    :return: 骨干网络的池化特征(N, C, float32)
+    """
+    device = next(net.parameters()).device
+    n_img = len(dataset)
+    s_time = time.time()
+    feats = np.zeros((n_img, net.conv3.in_channels), dtype=np.float32)
+    loader = DataLoader(dataset, batch_size=batch_size, **get_loader_kwargs(num_workers, persistent_workers=False))
+    net.eval()
+    idx = 0
+    with torch.inference_mode():
+        for img, _ in loader:
+            feat = net.forward_features(img.to(device, non_blocking=True)).flatten(1)
+            feats[idx:idx + len(feat)] = feat.cpu().numpy()
+            idx += len(feat)
+    print('[Info] 特征计算完成, 图片数: {}, 耗时: {:.1f}s'.format(n_img, time.time() - s_time))
+    return feats
+
+
+def save_feature_cache(cache_dir, cache_key, cached_feats, md5_rows, new_feats, new_md5s):
+    """
+    已有的特征和新特征写入新的内存映射文件，再替换旧文件；meta.json最后写入，中断时缓存无效而不是损坏
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    feat_path = os.path.join(cache_dir, "features.npy")
+    n_old = len(md5_rows)
+    n_channel = new_feats.shape[1]
+    tmp_path = feat_path + ".tmp.npy"
+    feats = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                      shape=(n_old + len(new_feats), n_channel))
+    if n_old:
+        feats[:n_old] = cached_feats
+    feats[n_old:] = new_feats
+    feats.flush()
+    del feats, cached_feats
+    md5s = [None] * n_old
+    for md5, row in md5_rows.items():
+        md5s[row] = md5
+    md5s += new_md5s
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)
+    os.replace(tmp_path, feat_path)
+    with open(meta_path, 'w') as f:
+        json.dump({"key": cache_key, "num": len(md5s), "dim": n_channel, "time": time.time(), "md5s": md5s}, f)
+    return load_feature_cache(cache_dir, cache_key)
+
+
+class HeadTrainer(object):
+    """
+    在缓存的特征上训练分类头，特征一次性拷贝到device，每个step只有两个1x1卷积
+    """
+    def __init__(self, net, train_data, valid_data, batch_size=256, lr=0.001, seed=47):
+        self.net = net
+        self.device = next(net.parameters()).device
+        for name, param in net.named_parameters():
+            param.requires_grad = name.startswith(HEAD_PREFIXES)
+        head_params = [param for param in net.parameters() if param.requires_grad]
+        self.optimizer = optim.Adam(head_params, lr=lr, betas=(0.9, 0.99))
+        self.criterion = nn.CrossEntropyLoss()
+        self.train_feats, self.train_labels = self.to_device(*train_data)
+        self.valid_feats, self.valid_labels = self.to_device(*valid_data)
+        self.batch_size = batch_size
+        self.generator = torch.Generator(device='cpu').manual_seed(seed)
+
+    def to_device(self, feats, labels):
+        return torch.from_numpy(np.array(feats, dtype=np.float32)).to(self.device), \
+               torch.from_numpy(labels).to(self.device)
+
+    def train_epoch(self):
+        self.net.train()
+        n = len(self.train_labels)
+        perm = torch.randperm(n, generator=self.generator).to(self.device)
+        loss_sum = torch.zeros((), device=self.device)
+        for i in range(0, n, self.batch_size):
+            idx = perm[i:i + self.batch_size]
+            out = self.net.forward_head(self.train_feats[idx])
+            loss = self.criterion(out, self.train_labels[idx])
+            self.optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            self.optimizer.step()
+            loss_sum += loss.detach() * len(idx)
+        return loss_sum.item() / max(n, 1)
+
+    def validate(self):
+        """
+        :return: 准确率, 混淆矩阵(numpy)
+        """
+        k = self.net.conv4.out_channels
+        self.net.eval()
+        with torch.inference_mode():
+            pred = torch.cat([self.net.forward_head(self.valid_feats[i:i + self.batch_size]).argmax(dim=1)
+                              for i in range(0, len(self.valid_labels), self.batch_size)])
+            confusion = torch.bincount(self.valid_labels * k + pred, minlength=k * k)
+        confusion = confusion.view(k, k).cpu().numpy()
+        return float(confusion.trace()) / max(int(confusion.sum()), 1), confusion
+
+    def train(self, max_epoch, out_path):
+        best_accuracy = -1.0
+        best_confusion = None
+        s_time = time.time()
+        for epoch in range(max_epoch):
+            train_loss = self.train_epoch()
+            accuracy, confusion = self.validate()
+            if accuracy > best_accuracy:
+                best_accuracy, best_confusion = accuracy, confusion
+                # 保存整个模型的权重，与train.py的输出相同，可以直接用于推理
+                torch.save(self.net.state_dict(), out_path)
+            if (epoch + 1) % 10 == 0 or epoch + 1 == max_epoch:
+                print('[Info] epoch: {}, loss: {:.4f}, 验证准确率: {:.4f}, 最优: {:.4f}'.format(
+                    epoch + 1, train_loss, accuracy, best_accuracy))
+        print('[Info] 训练完毕, 耗时: {:.1f}s, 权重: {}'.format(time.time() - s_time, out_path))
+        metrics = ClassificationMetrics(len(best_confusion))
+        metrics.update_confusion(best_confusion)
+        metrics.print_report()
+        return best_accuracy
+
+
+def parse_args():
+    """
+    处理脚本参数
+    """
+    parser = argparse.ArgumentParser(description='冻结骨干网络, 训练分类头')
+    parser.add_argument('-m', dest='weight_path', required=True, help='骨干网络的权重(train.py的输出)', type=str)
+    parser.add_argument('-k', dest='net_kind', required=False, help='模型类型, large或small', type=str, default='large')
+    parser.add_argument('-n', dest='num_classes', required=True, help='类别数', type=int)
+    parser.add_argument('-d', dest='data_dir', required=False, help='数据集文件夹, 包含train和val', type=str,
+                        default='data/splitData')
+    parser.add_argument('-p', dest='pack_dir', required=False, help='dataset.py打包的数据集, 包含train和val', type=str,
+                        default='')
+    parser.add_argument('-c', dest='cache_dir', required=False, help='特征缓存文件夹, 默认为数据集下的feature_cache',
+                        type=str, default='')
+    parser.add_argument('-e', dest='max_epoch', required=False, help='epoch数', type=int, default=100)
+    parser.add_argument('-b', dest='batch_size', required=False, help='batch大小', type=int, default=256)
+    parser.add_argument('--lr', dest='lr', required=False, help='学习率', type=float, default=0.001)
+    parser.add_argument('-w', dest='num_workers', required=False, help='计算特征时DataLoader的进程数', type=int,
+                        default=4)
+    parser.add_argument('-o', dest='out_path', required=False, help='输出权重', type=str, default='weights/head.pkl')
+    args = parser.parse_args()
+    print('[Info] 参数: {}'.format(vars(args)))
+    return args
+
+
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    net = build_net(args.net_kind, args.num_classes, args.weight_path).to(device)
+    cache_dir = args.cache_dir or os.path.join(args.pack_dir or args.data_dir, "feature_cache")
+    # 特征只与模型和图片内容有关，训练集和验证集共用一个缓存，重新划分数据集时也可以复用
+    cache_key = {"net_kind": args.net_kind, "weight_md5": get_file_md5(args.weight_path)}
+    split_data = dict()
+    for split in ("train", "val"):
+        dataset = get_dataset(args.data_dir, args.pack_dir, split)
+        split_data[split] = extract_features(net, dataset, cache_dir, cache_key, batch_size=64,
+                                             num_workers=args.num_workers)
+    if os.path.dirname(args.out_path):
+        os.makedirs(os.path.dirname(args.out_path), exist_ok=True)
+    trainer = HeadTrainer(net, split_data["train"], split_data["val"], batch_size=args.batch_size, lr=args.lr)
+    trainer.train(args.max_epoch, args.out_path)
+
+
+if __name__ == '__main__':
+    main()